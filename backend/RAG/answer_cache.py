@@ -0,0 +1,105 @@
+"""
+Per-document answer cache
+-------------------------
+
+FAQ-style questions about popular course PDFs are asked again and again.
+Grounded answers are cached in memory under
+
+    (shard, file_ids, document versions, normalised question)
+
+``file_ids`` is one document, or several for a multi-document question in
+the order they were asked for: that order numbers the ``[Document i]``
+labels the answer refers to, so "A, B" and "B, A" are different entries.
+Every ``ingest_file`` / ``delete_document`` bumps the document's version
+and drops every entry that involves it, so a cached answer can never outlive the index
+content it was generated from. An answer computed while the document was
+being re-ingested is stored under the old version and is never served.
+
+Entries expire after ``ttl_s`` seconds; beyond ``max_entries`` the least
+recently used ones are evicted.
+"""
+
+from __future__ import annotations
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger("RAG")
+
+CacheKey = Tuple[str, Tuple[str, ...], Tuple[int, ...], str]
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split()).rstrip("?!. ")
+
+
+class AnswerCache:
+    """
+    Thread-safe TTL + LRU cache of answers, versioned per document.
+    """
+
+    def __init__(self, max_entries: int, ttl_s: float) -> None:
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+
+        self._entries: "OrderedDict[CacheKey, Tuple[float, str]]" = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, shard: str, file_ids: Union[str, Sequence[str]], question: str) -> CacheKey:
+        """Key for the documents' *current* versions."""
+        scope = (file_ids,) if isinstance(file_ids, str) else tuple(dict.fromkeys(file_ids))
+        with self._lock:
+            versions = self._current(scope)
+        return (shard, scope, versions, normalize_question(question))
+
+    def _current(self, scope: Tuple[str, ...]) -> Tuple[int, ...]:
+        return tuple(self._versions.get(f, 0) for f in scope)
+
+    def get(self, key: CacheKey) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl_s:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: CacheKey, answer: str) -> None:
+        if self.max_entries <= 0 or self.ttl_s <= 0:
+            return
+
+        with self._lock:
+            # A document changed since the key was taken: don't store
+            if key[2] != self._current(key[1]):
+                return
+
+            self._entries[key] = (time.monotonic(), answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, file_id: str) -> None:
+        """Bump the document version and drop every answer that used it."""
+        with self._lock:
+            self._versions[file_id] = self._versions.get(file_id, 0) + 1
+            stale = [k for k in self._entries if file_id in k[1]]
+            for k in stale:
+                del self._entries[k]
+
+        if stale:
+            logger.info("[RAG] Answer cache invalidated | file=%s entries=%d", file_id, len(stale))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
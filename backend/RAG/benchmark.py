@@ -0,0 +1,375 @@
+"""
+Retrieval benchmark
+-------------------
+
+Measures the RAG pipeline on synthetic corpora with known answers, so a
+change to SPLITTER, TOP_K, the embedding model or the index type can be
+compared between versions:
+
+    cd backend
+    python -m RAG.benchmark --sizes 1k,10k,100k --out bench.json
+
+For each corpus size a set of PDFs is generated (one passage per page,
+each passage stating one unique fact) and ingested through
+``ingest_file`` into a dedicated shard. Labelled questions ask for those
+facts; a hit is a retrieved chunk of the right document containing the
+answer string.
+
+Reported per size:
+
+- ingest throughput (pages/s, chunks/s) of ``ingest_file``
+- recall@k and MRR of ``retrieve`` (what ``answer`` grounds on), both
+  per document (hybrid) and across the shard (dense)
+- p50 / p99 latency, end to end and with the query vector cached
+- resident and peak memory
+
+The LLM is never called. Everything runs inside ``--workdir`` (a fresh
+temp directory by default), never the app's own ``rag_data``.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from RAG.vector_shards import INDEX_TYPE, VECTOR_CODEC, index_codec, index_kind
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger("RAG")
+
+# ==================================================
+# CONFIG
+# ==================================================
+
+PAGES_PER_DOCUMENT = 1000
+QUERIES_PER_SIZE = 200
+RECALL_AT = (1, 5, 10)
+SEED = 1234
+
+# Templates: (fact sentence, question); {e} = entity, {a} = answer
+FACTS = (
+    ("The access code for project {e} is {a}.", "What is the access code for project {e}?"),
+    ("Shipment {e} was assigned tracking number {a}.", "Which tracking number does shipment {e} have?"),
+    ("The reference identifier of the {e} protocol is {a}.", "What is the reference identifier of the {e} protocol?"),
+    ("Error {a} is raised when the {e} service rejects a request.", "Which error does the {e} service raise when it rejects a request?"),
+)
+
+_SYLLABLES = (
+    "ka", "lo", "mi", "ve", "tor", "an", "qu", "ri", "sel", "mon", "da", "pe",
+    "zu", "bar", "ni", "ost", "el", "gra", "fi", "un", "ho", "ter", "vas", "ly",
+)
+
+# ==================================================
+# SYNTHETIC CORPUS
+# ==================================================
+
+def _word(rng: random.Random, syllables: int) -> str:
+    return "".join(rng.choice(_SYLLABLES) for _ in range(syllables))
+
+
+def _answer(rng: random.Random) -> str:
+    letters = "ABCDEFGHJKLMNPQRSTUVWXYZ"
+    return f"{rng.choice(letters)}{rng.choice(letters)}-{rng.randrange(10**5, 10**6)}"
+
+
+class Corpus:
+    """
+    ``size`` passages split into PDFs of PAGES_PER_DOCUMENT pages.
+
+    Passages are regenerated from the seed, so questions and answers
+    never need to be stored next to the PDFs.
+    """
+
+    def __init__(self, size: int, seed: int = SEED) -> None:
+        self.size = size
+        self.seed = seed
+        self.documents = (size + PAGES_PER_DOCUMENT - 1) // PAGES_PER_DOCUMENT
+
+    def _passages(self, doc: int) -> List[Tuple[str, str, str]]:
+        """(passage, question, answer) per page of document ``doc``."""
+        rng = random.Random(f"{self.seed}:{self.size}:{doc}")
+        vocab_rng = random.Random(self.seed)
+        vocab = [_word(vocab_rng, vocab_rng.randint(2, 4)) for _ in range(4000)]
+
+        start = doc * PAGES_PER_DOCUMENT
+        count = min(PAGES_PER_DOCUMENT, self.size - start)
+
+        passages = []
+        for n in range(count):
+            entity = f"{_word(rng, 3).capitalize()}-{start + n}"
+            answer = _answer(rng)
+            fact, question = rng.choice(FACTS)
+
+            # Filler shares vocabulary across passages (distractors)
+            sentences = [
+                " ".join(rng.choice(vocab) for _ in range(rng.randint(8, 14))).capitalize() + "."
+                for _ in range(8)
+            ]
+            sentences.insert(rng.randrange(len(sentences) + 1), fact.format(e=entity, a=answer))
+
+            passages.append((" ".join(sentences), question.format(e=entity), answer))
+        return passages
+
+    def write(self, directory: str) -> List[str]:
+        """Write (or reuse) the corpus PDFs; returns their paths."""
+        import fitz  # PyMuPDF
+
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+
+        for doc in range(self.documents):
+            path = os.path.join(directory, f"doc-{doc:05d}.pdf")
+            paths.append(path)
+            if os.path.exists(path):
+                continue
+
+            pdf = fitz.open()
+            for passage, _, _ in self._passages(doc):
+                page = pdf.new_page()
+                page.insert_textbox(page.rect + (54, 54, -54, -54), passage, fontsize=10)
+            pdf.save(path + ".tmp")
+            pdf.close()
+            os.replace(path + ".tmp", path)
+
+        return paths
+
+    def queries(self, count: int) -> List[Tuple[int, str, str]]:
+        """``count`` labelled questions: (document, question, answer)."""
+        rng = random.Random(f"{self.seed}:{self.size}:queries")
+        picks = sorted(rng.sample(range(self.size), min(count, self.size)))
+
+        out = []
+        cache: Dict[int, List[Tuple[str, str, str]]] = {}
+        for n in picks:
+            doc, page = divmod(n, PAGES_PER_DOCUMENT)
+            if doc not in cache:
+                cache = {doc: self._passages(doc)}
+            _, question, answer = cache[doc][page]
+            out.append((doc, question, answer))
+
+        rng.shuffle(out)
+        return out
+
+# ==================================================
+# MEASUREMENT
+# ==================================================
+
+def _memory_mb() -> Dict[str, Optional[float]]:
+    rss = peak = None
+
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # KiB on Linux, bytes on macOS
+        peak = peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+    return {
+        "rss_mb": round(rss, 1) if rss is not None else None,
+        "peak_rss_mb": round(peak, 1) if peak is not None else None,
+    }
+
+
+def _percentiles(samples_s: Sequence[float]) -> Dict[str, float]:
+    ms = np.asarray(samples_s, dtype=np.float64) * 1000
+    return {
+        "p50": round(float(np.percentile(ms, 50)), 3),
+        "p99": round(float(np.percentile(ms, 99)), 3),
+        "mean": round(float(ms.mean()), 3),
+    }
+
+
+def _rank(docs, file_id: str, answer: str) -> Optional[int]:
+    """1-based rank of the first chunk that holds the answer, or None."""
+    for rank, doc in enumerate(docs, start=1):
+        if doc.metadata.get("file_id") == file_id and answer in doc.page_content:
+            return rank
+    return None
+
+
+def _quality(ranks: List[Optional[int]], recall_at: Sequence[int]) -> Dict[str, float]:
+    n = len(ranks) or 1
+    out = {
+        f"recall@{k}": round(sum(1 for r in ranks if r is not None and r <= k) / n, 4)
+        for k in recall_at
+    }
+    out["mrr"] = round(sum(1.0 / r for r in ranks if r is not None) / n, 4)
+    return out
+
+
+def run_size(engine, corpus: Corpus, workdir: str, queries: int, recall_at: Sequence[int]) -> Dict:
+    user_id = f"bench-{corpus.size}"
+    paths = corpus.write(os.path.join(workdir, "corpus", str(corpus.size)))
+    file_ids = [f"bench-{corpus.size}-{n:05d}" for n in range(len(paths))]
+
+    # -------- INGEST --------
+    started = time.perf_counter()
+    for file_id, path in zip(file_ids, paths):
+        engine.ingest_file(
+            file_id=file_id,
+            file_path=path,
+            mimetype="application/pdf",
+            user_id=user_id,
+        )
+    # Fold segments into the index type the shard size calls for
+    engine.compact_index(user_id)
+    ingest_s = time.perf_counter() - started
+
+    shard = engine.SHARDS.get(user_id)
+    chunks = sum(len(shard.file_vector_ids(f)) for f in file_ids)
+
+    # -------- RETRIEVAL --------
+    k = max(recall_at)
+    ranks: Dict[str, List[Optional[int]]] = {"document": [], "shard": []}
+    latency: Dict[str, Dict[str, List[float]]] = {
+        scope: {"end_to_end": [], "search": []} for scope in ranks
+    }
+
+    query_cache = engine.CACHED_EMBEDDINGS.query_cache
+
+    for doc, question, answer in corpus.queries(queries):
+        file_id = file_ids[doc]
+        for scope, scoped_file in (("document", file_id), ("shard", None)):
+            # First call embeds the question; the second is served the
+            # query vector from the LRU, leaving pure search time.
+            if query_cache is not None:
+                query_cache.clear()
+            for phase in ("end_to_end", "search"):
+                t0 = time.perf_counter()
+                hits = engine.retrieve(question, k=k, file_id=scoped_file, user_id=user_id)
+                latency[scope][phase].append(time.perf_counter() - t0)
+            ranks[scope].append(_rank(hits, file_id, answer))
+
+    return {
+        "size": corpus.size,
+        "documents": len(paths),
+        "pages": corpus.size,
+        "chunks": chunks,
+        "index": {"kind": index_kind(shard.index), "codec": index_codec(shard.index)},
+        "ingest": {
+            "seconds": round(ingest_s, 3),
+            "pages_per_s": round(corpus.size / ingest_s, 1),
+            "chunks_per_s": round(chunks / ingest_s, 1),
+        },
+        "retrieval": {
+            scope: {
+                "queries": len(ranks[scope]),
+                "k": k,
+                **_quality(ranks[scope], recall_at),
+                "latency_ms": {phase: _percentiles(s) for phase, s in latency[scope].items()},
+            }
+            for scope in ranks
+        },
+        "memory": _memory_mb(),
+    }
+
+# ==================================================
+# CLI
+# ==================================================
+
+def _parse_size(text: str) -> int:
+    text = text.strip().lower()
+    scale = {"k": 1_000, "m": 1_000_000}.get(text[-1:], 1)
+    return int(float(text[:-1] if scale > 1 else text) * scale)
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv: Optional[Sequence[str]] = None) -> Dict:
+    parser = argparse.ArgumentParser(description="RAG retrieval benchmark (no LLM calls)")
+    parser.add_argument(
+        "--sizes",
+        default="1k,10k",
+        help="corpus sizes in pages (one passage each), e.g. 1k,10k,100k,1m",
+    )
+    parser.add_argument("--queries", type=int, default=QUERIES_PER_SIZE)
+    parser.add_argument("--recall-at", default=",".join(map(str, RECALL_AT)))
+    parser.add_argument(
+        "--workdir",
+        default=None,
+        help="reuse corpora here between runs (note: the embedding cache is reused too)",
+    )
+    parser.add_argument("--out", default=None, help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    sizes = [_parse_size(s) for s in args.sizes.split(",") if s.strip()]
+    recall_at = sorted({int(k) for k in args.recall_at.split(",")})
+    out_path = os.path.abspath(args.out) if args.out else None
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="rag-bench-"))
+    os.makedirs(workdir, exist_ok=True)
+
+    # rag_engine keeps its data under ./rag_data and needs a key to
+    # import; retrieval never reaches the LLM.
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if backend_dir not in sys.path:
+        sys.path.insert(0, backend_dir)
+    os.chdir(workdir)
+    os.environ.setdefault("OPENROUTER_API_KEY", "benchmark-no-llm")
+    logging.getLogger("RAG").setLevel(logging.WARNING)
+
+    from RAG import rag_engine as engine
+
+    report = {
+        "revision": _git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "workdir": workdir,
+        "config": {
+            "embedding_model": engine.CACHED_EMBEDDINGS.model_name,
+            "chunk_size": engine.CHUNK_SIZE,
+            "chunk_overlap": engine.CHUNK_OVERLAP,
+            "top_k": engine.TOP_K,
+            "hybrid_fetch_k": engine.HYBRID_FETCH_K,
+            "hybrid_alpha": engine.HYBRID_ALPHA,
+            "index_type": INDEX_TYPE,
+            "vector_codec": VECTOR_CODEC,
+        },
+        "runs": [],
+    }
+
+    for size in sizes:
+        logger.warning("[RAG] Benchmark | size=%d", size)
+        report["runs"].append(run_size(engine, Corpus(size), workdir, args.queries, recall_at))
+
+    text = json.dumps(report, indent=2)
+    if out_path:
+        with open(out_path, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    main()
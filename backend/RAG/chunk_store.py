@@ -0,0 +1,158 @@
+"""
+SQLite chunk docstore
+---------------------
+
+Chunk text and metadata of one shard live in a SQLite table keyed by the
+chunk's vector ID:
+
+    chunks(vector_id INTEGER PRIMARY KEY, file_id TEXT, text TEXT, metadata TEXT)
+
+with an index on ``file_id``. Writes touch only the rows that changed
+(nothing is pickled wholesale), listing or deleting one file's chunks is an
+index range scan, and the database runs in WAL mode so reads do not wait on
+a commit.
+
+Only recently used rows are kept in memory: an LRU of ``Document`` objects
+plus a small LRU of per-file vector ID lists for file-scoped searches.
+"""
+
+from __future__ import annotations
+
+import os
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from langchain_core.documents import Document
+
+# Rows / files kept in memory per shard
+CACHE_ROWS = int(os.getenv("RAG_DOCSTORE_CACHE_ROWS", "4096"))
+CACHE_FILES = 64
+
+_SQLITE_MAX_VARS = 900
+
+
+class ChunkStore:
+    """
+    ``vector_id -> Document`` rows in SQLite with a hot-row LRU.
+    """
+
+    def __init__(self, path: str, cache_rows: int = CACHE_ROWS) -> None:
+        self.path = path
+        self.cache_rows = cache_rows
+        self._lock = threading.Lock()
+        self._rows: "OrderedDict[int, Document]" = OrderedDict()
+        self._files: "OrderedDict[str, List[int]]" = OrderedDict()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " vector_id INTEGER PRIMARY KEY,"
+            " file_id TEXT,"
+            " text TEXT NOT NULL,"
+            " metadata TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_file_id ON chunks(file_id)")
+        self._conn.commit()
+
+    # ---------------- write ----------------
+
+    def add(self, ids: Sequence[int], docs: Sequence[Document]) -> None:
+        rows = [
+            (int(vid), doc.metadata.get("file_id"), doc.page_content, json.dumps(doc.metadata))
+            for vid, doc in zip(ids, docs)
+        ]
+        if not rows:
+            return
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (vector_id, file_id, text, metadata) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            for _, file_id, _, _ in rows:
+                self._files.pop(file_id, None)
+
+    def delete(self, ids: Iterable[int]) -> None:
+        ids = [int(vid) for vid in ids]
+        if not ids:
+            return
+
+        with self._lock:
+            for i in range(0, len(ids), _SQLITE_MAX_VARS):
+                batch = ids[i:i + _SQLITE_MAX_VARS]
+                marks = ",".join("?" * len(batch))
+                self._conn.execute(f"DELETE FROM chunks WHERE vector_id IN ({marks})", batch)
+            self._conn.commit()
+            for vid in ids:
+                self._rows.pop(vid, None)
+            self._files.clear()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.commit()
+            self._rows.clear()
+            self._files.clear()
+
+    # ---------------- read ----------------
+
+    def get(self, vector_id: int) -> Optional[Document]:
+        with self._lock:
+            doc = self._rows.get(vector_id)
+            if doc is not None:
+                self._rows.move_to_end(vector_id)
+                return doc
+
+            row = self._conn.execute(
+                "SELECT text, metadata FROM chunks WHERE vector_id = ?", (int(vector_id),)
+            ).fetchone()
+            if row is None:
+                return None
+
+            doc = Document(page_content=row[0], metadata=json.loads(row[1]))
+            if self.cache_rows > 0:
+                self._rows[vector_id] = doc
+                while len(self._rows) > self.cache_rows:
+                    self._rows.popitem(last=False)
+            return doc
+
+    def file_ids(self, file_id: str) -> List[int]:
+        """Vector IDs of ``file_id``'s chunks, ascending."""
+        with self._lock:
+            ids = self._files.get(file_id)
+            if ids is None:
+                ids = [
+                    vid for (vid,) in self._conn.execute(
+                        "SELECT vector_id FROM chunks WHERE file_id = ? ORDER BY vector_id",
+                        (file_id,),
+                    )
+                ]
+                self._files[file_id] = ids
+                while len(self._files) > CACHE_FILES:
+                    self._files.popitem(last=False)
+            else:
+                self._files.move_to_end(file_id)
+            return list(ids)
+
+    def ids(self) -> np.ndarray:
+        """Every stored vector ID."""
+        with self._lock:
+            cursor = self._conn.execute("SELECT vector_id FROM chunks")
+            return np.fromiter((vid for (vid,) in cursor), dtype=np.int64)
+
+    def head(self, limit: int) -> List[str]:
+        """Texts of the first ``limit`` chunks (oldest first)."""
+        with self._lock:
+            return [
+                text for (text,) in self._conn.execute(
+                    "SELECT text FROM chunks ORDER BY vector_id LIMIT ?", (max(limit, 0),)
+                )
+            ]
@@ -0,0 +1,90 @@
+"""
+Named document collections
+--------------------------
+
+A collection is a user-chosen name for a set of file_ids ("semester-1
+notes", "vendor contracts") that can be queried as one scope:
+
+    collections(shard TEXT, name TEXT, file_id TEXT, position INTEGER)
+
+Names are per shard (user). Deleting a document removes it from every
+collection of its shard.
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+from typing import List, Sequence
+
+
+class CollectionStore:
+    """
+    ``(shard, name) -> [file_id, ...]`` in SQLite.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS collections ("
+            " shard TEXT NOT NULL,"
+            " name TEXT NOT NULL,"
+            " file_id TEXT NOT NULL,"
+            " position INTEGER NOT NULL,"
+            " PRIMARY KEY (shard, name, file_id))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_collections_file ON collections(shard, file_id)"
+        )
+        self._conn.commit()
+
+    def put(self, shard: str, name: str, file_ids: Sequence[str]) -> List[str]:
+        """Create or replace collection ``name``; returns its file_ids."""
+        unique = list(dict.fromkeys(file_ids))
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM collections WHERE shard = ? AND name = ?", (shard, name)
+            )
+            self._conn.executemany(
+                "INSERT INTO collections (shard, name, file_id, position) VALUES (?, ?, ?, ?)",
+                [(shard, name, fid, pos) for pos, fid in enumerate(unique)],
+            )
+            self._conn.commit()
+        return unique
+
+    def get(self, shard: str, name: str) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT file_id FROM collections WHERE shard = ? AND name = ? ORDER BY position",
+                (shard, name),
+            ).fetchall()
+        return [fid for (fid,) in rows]
+
+    def names(self, shard: str) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT name FROM collections WHERE shard = ? ORDER BY name", (shard,)
+            ).fetchall()
+        return [name for (name,) in rows]
+
+    def delete(self, shard: str, name: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM collections WHERE shard = ? AND name = ?", (shard, name)
+            )
+            self._conn.commit()
+        return cursor.rowcount > 0
+
+    def remove_file(self, shard: str, file_id: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM collections WHERE shard = ? AND file_id = ?", (shard, file_id)
+            )
+            self._conn.commit()
@@ -0,0 +1,235 @@
+"""
+Content-addressed ingestion artifacts
+-------------------------------------
+
+The same handout is uploaded by many students, each upload getting its own
+file_id. Extraction (OCR) and embedding only depend on the file's bytes, so
+their results are stored once per SHA-256 of the upload:
+
+    rag_data/content/<sha256>.pages    paged raw text (hard-linked per file)
+    rag_data/content/<sha256>.chunks   chunk texts, page numbers, vectors
+                                       (a pickle per ingest batch)
+
+A duplicate upload hard-links the pages file to its own raw-text path and
+adds the stored vectors to the uploader's shard under its own file_id, so
+raw text, vectors, BM25 and deletes keep working per file_id while OCR and
+embedding are skipped entirely.
+
+``content_refs`` (SQLite) records which file_ids use which hash; a blob is
+removed when its last file is deleted.
+
+Blobs are written while the file is ingested (``ContentStore.writer``), one
+batch at a time, and only help later duplicates: a failure to write one is
+logged and never fails the ingest.
+"""
+
+from __future__ import annotations
+
+import os
+import pickle
+import shutil
+import sqlite3
+import logging
+import threading
+import uuid
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("RAG")
+
+# (chunk texts, page numbers, float32 vectors)
+Chunks = Tuple[List[str], List[int], np.ndarray]
+
+
+def _temp_path(dst: str) -> str:
+    """Unique temp name next to ``dst``: concurrent identical uploads
+    write the same blobs and must not share one."""
+    return f"{dst}.{uuid.uuid4().hex}.tmp"
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    tmp = _temp_path(dst)
+    try:
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+class ContentStore:
+    """
+    Extraction + embedding results keyed by content hash.
+
+    Chunks are only reused when they were produced with the same
+    embedding model / chunking configuration (``model_key``).
+    """
+
+    def __init__(self, directory: str, model_key: str) -> None:
+        self.directory = directory
+        self.model_key = model_key
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(
+            os.path.join(directory, "refs.sqlite3"),
+            check_same_thread=False,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS content_refs ("
+            " file_id TEXT PRIMARY KEY,"
+            " hash TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_content_refs_hash ON content_refs(hash)"
+        )
+        self._conn.commit()
+
+    def _path(self, content_hash: str, ext: str) -> str:
+        return os.path.join(self.directory, f"{content_hash}.{ext}")
+
+    # ---------------- read ----------------
+
+    def load(self, content_hash: str) -> Optional[Chunks]:
+        """Stored chunks for ``content_hash``, or None (miss / other model)."""
+        pages_path = self._path(content_hash, "pages")
+        chunks_path = self._path(content_hash, "chunks")
+        if not (os.path.exists(pages_path) and os.path.exists(chunks_path)):
+            return None
+
+        try:
+            with open(chunks_path, "rb") as f:
+                head = pickle.load(f)
+                if isinstance(head, tuple):
+                    # Single-pickle blob written before batching
+                    model_key, texts, pages, vectors = head
+                    return (texts, pages, vectors) if model_key == self.model_key else None
+
+                if head != self.model_key:
+                    return None
+
+                texts, pages, vectors = [], [], []
+                while True:
+                    try:
+                        batch_texts, batch_pages, batch_vectors = pickle.load(f)
+                    except EOFError:
+                        break
+                    texts.extend(batch_texts)
+                    pages.extend(batch_pages)
+                    vectors.append(batch_vectors)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            logger.warning("[RAG] Unreadable content blob ignored | hash=%s", content_hash)
+            return None
+
+        if not vectors:
+            return None
+        return texts, pages, np.vstack(vectors)
+
+    def link_pages(self, content_hash: str, dest: str) -> None:
+        """Give ``dest`` the stored raw text (hard link, O(1))."""
+        _link_or_copy(self._path(content_hash, "pages"), dest)
+
+    # ---------------- write ----------------
+
+    def writer(self, content_hash: str) -> "ChunksWriter":
+        """Stream a freshly ingested file's chunks into a new blob."""
+        return ChunksWriter(self, content_hash)
+
+    def add_ref(self, file_id: str, content_hash: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO content_refs (file_id, hash) VALUES (?, ?)",
+                (file_id, content_hash),
+            )
+            self._conn.commit()
+
+    def release(self, file_id: str) -> None:
+        """Drop ``file_id``'s reference; delete the blob if it was the last."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT hash FROM content_refs WHERE file_id = ?", (file_id,)
+            ).fetchone()
+            if row is None:
+                return
+
+            content_hash = row[0]
+            self._conn.execute("DELETE FROM content_refs WHERE file_id = ?", (file_id,))
+            remaining = self._conn.execute(
+                "SELECT COUNT(*) FROM content_refs WHERE hash = ?", (content_hash,)
+            ).fetchone()[0]
+            self._conn.commit()
+
+            if remaining:
+                return
+
+            for ext in ("pages", "chunks"):
+                path = self._path(content_hash, ext)
+                if os.path.exists(path):
+                    os.remove(path)
+
+        logger.info("[RAG] Content blob released | hash=%s", content_hash)
+
+
+class ChunksWriter:
+    """
+    Appends chunk batches to a temp blob; ``commit()`` links the raw text
+    and renames the blob into place, ``abort()`` drops it.
+
+    Best-effort: the first I/O error is logged and the blob is abandoned.
+    """
+
+    def __init__(self, store: ContentStore, content_hash: str) -> None:
+        self.content_hash = content_hash
+        self._store = store
+        self._path = store._path(content_hash, "chunks")
+        self._tmp = _temp_path(self._path)
+        self._file = None
+
+        try:
+            self._file = open(self._tmp, "wb")
+            pickle.dump(store.model_key, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            self._fail()
+
+    def add(self, texts: List[str], pages: List[int], vectors: np.ndarray) -> None:
+        if self._file is None:
+            return
+        try:
+            pickle.dump(
+                (texts, pages, np.asarray(vectors, dtype=np.float32)),
+                self._file,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        except OSError:
+            self._fail()
+
+    def commit(self, pages_path: str) -> None:
+        if self._file is None:
+            return
+        try:
+            self._file.close()
+            self._file = None
+            _link_or_copy(pages_path, self._store._path(self.content_hash, "pages"))
+            os.replace(self._tmp, self._path)
+        except OSError:
+            self._fail()
+
+    def abort(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if os.path.exists(self._tmp):
+            os.remove(self._tmp)
+
+    def _fail(self) -> None:
+        logger.exception("[RAG] Content blob not stored | hash=%s", self.content_hash[:12])
+        try:
+            self.abort()
+        except OSError:
+            pass
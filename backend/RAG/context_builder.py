@@ -0,0 +1,411 @@
+"""
+Token-budgeted context packing
+------------------------------
+
+Retrieved chunks are not pasted into the prompt as-is:
+
+- Candidates are ordered by MMR (maximal marginal relevance): each pick
+  trades retrieval relevance against cosine similarity to the chunks
+  already picked, so near-duplicates stop crowding out other evidence
+- Chunks from the same page that overlap (the splitter's
+  ``chunk_overlap``) are merged, so the shared text is paid for once
+- Chunks are added whole until the model's token budget is full; a chunk
+  is never cut mid-sentence
+- For multi-document questions each document's part of the context starts
+  with a label line (e.g. ``[Document 2]``) so the model can tell sources
+  apart; labels count against the budget and survive compression
+
+Optionally the packed context is then compressed extractively: only the
+sentences most similar to the query embedding (and their neighbours) are
+kept, with no extra LLM call.
+
+Tokens are counted with ``tiktoken`` when it is installed (and its
+encoding files are available), otherwise estimated at ~4 characters per
+token.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import logging
+import functools
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from langchain_core.documents import Document
+
+try:
+    # Optional: real BPE token counts
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger("RAG")
+
+# ==================================================
+# CONFIG
+# ==================================================
+
+# Context windows of the chat models we route to (tokens)
+MODEL_CONTEXT_TOKENS: Dict[str, int] = {
+    "meta-llama/llama-3-8b-instruct": 8_192,
+    "meta-llama/llama-3-70b-instruct": 8_192,
+    "meta-llama/llama-3.1-8b-instruct": 131_072,
+    "openai/gpt-4o-mini": 128_000,
+    "openai/gpt-4o": 128_000,
+}
+DEFAULT_CONTEXT_TOKENS = 8_192
+
+# Room kept for the answer and for the instructions around the context
+COMPLETION_RESERVE_TOKENS = 1_024
+PROMPT_OVERHEAD_TOKENS = 128
+
+# Upper bound on document context, whatever the window allows
+MAX_CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", "1500"))
+
+# 1.0 = pure relevance order, lower = more diversity
+MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+
+# Shared runs treated as splitter overlap (chunk_overlap is 200 chars)
+MIN_MERGE_OVERLAP = 20
+MAX_MERGE_OVERLAP = 400
+
+CHUNK_SEPARATOR = "\n\n"
+
+# Extractive compression: share of the packed context's tokens kept, and
+# the size below which a context is left alone
+COMPRESS_KEEP_RATIO = float(os.getenv("RAG_COMPRESS_KEEP_RATIO", "0.4"))
+COMPRESS_MIN_TOKENS = 300
+
+# A single newline is a PDF line wrap, not a sentence end (see split_sentences)
+_SENTENCE_END = re.compile(r"[.!?](?=\s|$)|\n\s*\n")
+
+# ==================================================
+# TOKEN COUNTING
+# ==================================================
+
+@functools.lru_cache(maxsize=8)
+def _encoding(model: Optional[str]):
+    if tiktoken is None:
+        return None
+
+    name = "o200k_base" if model and model.startswith("openai/gpt-4o") else "cl100k_base"
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception:
+        # Encoding files are downloaded on first use; offline hosts estimate
+        logger.warning("[RAG] tiktoken encoding unavailable, estimating tokens | encoding=%s", name)
+        return None
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    encoding = _encoding(model)
+    if encoding is None:
+        return max(1, len(text) // 4) if text else 0
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def context_budget(model: str, question: str) -> int:
+    """Tokens available for document context in one prompt to ``model``."""
+    window = MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS)
+    available = (
+        window
+        - COMPLETION_RESERVE_TOKENS
+        - PROMPT_OVERHEAD_TOKENS
+        - count_tokens(question, model)
+    )
+    return max(0, min(MAX_CONTEXT_TOKENS, available))
+
+# ==================================================
+# MMR + OVERLAP MERGING
+# ==================================================
+
+def mmr_order(relevance: np.ndarray, vectors: Optional[np.ndarray], lam: float = MMR_LAMBDA) -> List[int]:
+    """
+    Candidate positions in MMR order.
+
+    Without vectors this is plain relevance order.
+    """
+    n = len(relevance)
+    if vectors is None or n < 2:
+        return [int(i) for i in np.argsort(-relevance)]
+
+    rel = np.asarray(relevance, dtype=np.float32)
+    span = float(rel.max() - rel.min())
+    rel = (rel - rel.min()) / span if span > 1e-9 else np.ones_like(rel)
+
+    unit = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+    sim = unit @ unit.T
+
+    order = [int(np.argmax(rel))]
+    max_sim = sim[order[0]].copy()
+    remaining = np.ones(n, dtype=bool)
+    remaining[order[0]] = False
+
+    while remaining.any():
+        score = lam * rel - (1.0 - lam) * max_sim
+        score[~remaining] = -np.inf
+        pick = int(np.argmax(score))
+        order.append(pick)
+        remaining[pick] = False
+        max_sim = np.maximum(max_sim, sim[pick])
+
+    return order
+
+
+def _overlap(left: str, right: str) -> int:
+    """Length of the longest suffix of ``left`` that prefixes ``right``."""
+    for size in range(min(len(left), len(right), MAX_MERGE_OVERLAP), MIN_MERGE_OVERLAP - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _merge_into(segments: List[str], text: str) -> List[str]:
+    """Add ``text`` to one page's segments, merging overlaps / containment."""
+    if any(text in seg for seg in segments):
+        return segments
+
+    merged = text
+    rest: List[str] = []
+    for seg in segments:
+        if seg in merged:
+            continue
+        head = _overlap(seg, merged)
+        tail = _overlap(merged, seg) if not head else 0
+        if head:
+            merged = seg + merged[head:]
+        elif tail:
+            merged = merged + seg[tail:]
+        else:
+            rest.append(seg)
+
+    # A merge can make the grown segment overlap ones already passed
+    if len(rest) < len(segments):
+        return _merge_into(rest, merged)
+    return rest + [merged]
+
+# ==================================================
+# PACKING
+# ==================================================
+
+def _render(
+    pages: Dict[Tuple[str, int], List[str]],
+    labels: Optional[Dict[str, str]] = None,
+) -> str:
+    # Documents in label order ([Document 1] first), pages in reading order
+    rank = {file_id: i for i, file_id in enumerate(labels or ())}
+    parts: List[str] = []
+    current = None
+    for key in sorted(pages, key=lambda k: (rank.get(k[0], len(rank)), k)):
+        if labels and key[0] != current and key[0] in labels:
+            parts.append(labels[key[0]])
+        current = key[0]
+        parts.extend(pages[key])
+    return CHUNK_SEPARATOR.join(parts)
+
+
+def _truncate_to_sentence(text: str, budget: int, model: Optional[str]) -> str:
+    """Longest prefix of whole sentences within ``budget`` tokens."""
+    ends = [m.end() for m in _SENTENCE_END.finditer(text)]
+    best = ""
+    lo, hi = 0, len(ends) - 1
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        candidate = text[:ends[mid]].strip()
+        if count_tokens(candidate, model) <= budget:
+            best = candidate
+            lo = mid + 1
+        else:
+            hi = mid - 1
+    return best
+
+
+def pack_context(
+    docs: Sequence[Document],
+    relevance: Sequence[float],
+    vectors: Optional[np.ndarray],
+    *,
+    budget: int,
+    model: Optional[str] = None,
+    labels: Optional[Dict[str, str]] = None,
+) -> Tuple[str, List[Document]]:
+    """
+    Build the context string for ``docs`` within ``budget`` tokens.
+
+    ``labels`` maps file_id -> label line put before that document's
+    chunks. Returns the context (document / page order) and the chunks
+    used.
+    """
+    if not docs or budget <= 0:
+        return "", []
+
+    order = mmr_order(np.asarray(relevance, dtype=np.float32), vectors)
+
+    pages: Dict[Tuple[str, int], List[str]] = {}
+    used: List[Document] = []
+    tokens = 0
+
+    for i in order:
+        doc = docs[i]
+        key = (str(doc.metadata.get("file_id", "")), int(doc.metadata.get("page", 0) or 0))
+        text = doc.page_content.strip()
+        if not text:
+            continue
+
+        before = pages.get(key, [])
+        after = _merge_into(list(before), text)
+        if after == before:
+            continue  # already covered by a picked chunk
+
+        pages[key] = after
+        candidate_tokens = count_tokens(_render(pages, labels), model)
+        if candidate_tokens > budget:
+            pages[key] = before
+            if not before:
+                del pages[key]
+            continue
+
+        tokens = candidate_tokens
+        used.append(doc)
+
+    if not used:
+        # Even the best chunk is over budget: keep its leading sentences
+        best = docs[order[0]]
+        label = (labels or {}).get(str(best.metadata.get("file_id", "")))
+        if label:
+            budget -= count_tokens(label + CHUNK_SEPARATOR, model)
+        text = _truncate_to_sentence(best.page_content.strip(), budget, model)
+        if text and label:
+            text = label + CHUNK_SEPARATOR + text
+        return text, [best] if text else []
+
+    context = _render(pages, labels)
+
+    logger.info(
+        "[RAG] Context packed | candidates=%d used=%d tokens=%d budget=%d",
+        len(docs),
+        len(used),
+        tokens,
+        budget,
+    )
+    return context, used
+
+# ==================================================
+# EXTRACTIVE COMPRESSION
+# ==================================================
+
+# PDF text is hard-wrapped: a single newline is a line break inside a
+# sentence, only a blank line ends a paragraph
+_PARAGRAPH_SPLIT = re.compile(r"\n\s*\n")
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+
+
+def split_sentences(text: str) -> List[str]:
+    sentences: List[str] = []
+    for paragraph in _PARAGRAPH_SPLIT.split(text):
+        joined = " ".join(paragraph.split())
+        sentences.extend(s for s in _SENTENCE_SPLIT.split(joined) if s)
+    return sentences
+
+
+def compress_context(
+    context: str,
+    query_vector: np.ndarray,
+    embed: Callable[[List[str]], List[List[float]]],
+    *,
+    budget: Optional[int] = None,
+    model: Optional[str] = None,
+    pinned: Sequence[str] = (),
+) -> str:
+    """
+    Keep the sentences of ``context`` closest to the query, plus their
+    neighbours, within ``budget`` tokens (default: COMPRESS_KEEP_RATIO of
+    the context, at least COMPRESS_MIN_TOKENS).
+
+    Sentences are scored by cosine similarity to ``query_vector`` in one
+    matrix product; kept sentences stay in document order and dropped
+    runs are marked with " ... ". Segments equal to one of ``pinned``
+    (document labels) are kept as-is while their document keeps any
+    sentence.
+    """
+    total = count_tokens(context, model)
+    if budget is None:
+        budget = max(COMPRESS_MIN_TOKENS, int(total * COMPRESS_KEEP_RATIO))
+
+    pinned = set(pinned)
+    raw = context.split(CHUNK_SEPARATOR)
+    segments = [[] if seg in pinned else split_sentences(seg) for seg in raw]
+    flat = [(s, p) for s, sentences in enumerate(segments) for p in range(len(sentences))]
+    if not flat or total <= budget:
+        return context
+
+    texts = [segments[s][p] for s, p in flat]
+    vectors = np.asarray(embed(texts), dtype=np.float32)
+    query = np.asarray(query_vector, dtype=np.float32).reshape(-1)
+
+    unit = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+    scores = unit @ (query / max(float(np.linalg.norm(query)), 1e-12))
+
+    position = {key: i for i, key in enumerate(flat)}
+    cost = [count_tokens(t, model) + 1 for t in texts]
+    keep = set()
+    used = 0
+
+    def take(i: int) -> bool:
+        nonlocal used
+        if i in keep:
+            return True
+        if used + cost[i] > budget:
+            return False
+        keep.add(i)
+        used += cost[i]
+        return True
+
+    for i in np.argsort(-scores):
+        if not take(int(i)):
+            continue
+        # Neighbours carry the referents ("it", "this value") of a hit
+        s, p = flat[i]
+        for q in (p - 1, p + 1):
+            j = position.get((s, q))
+            if j is not None:
+                take(j)
+        if used >= budget:
+            break
+
+    out = []
+    for s, sentences in enumerate(segments):
+        if raw[s] in pinned:
+            # Replaces a label whose document lost every sentence
+            if out and out[-1] in pinned:
+                out.pop()
+            out.append(raw[s])
+            continue
+
+        parts, gap = [], False
+        for p, sentence in enumerate(sentences):
+            if position[(s, p)] in keep:
+                if gap and parts:
+                    parts.append("...")
+                parts.append(sentence)
+                gap = False
+            else:
+                gap = True
+        if parts:
+            out.append(" ".join(parts))
+
+    if out and out[-1] in pinned:
+        out.pop()
+    compressed = CHUNK_SEPARATOR.join(out)
+
+    logger.info(
+        "[RAG] Context compressed | sentences=%d kept=%d tokens=%d->%d",
+        len(flat),
+        len(keep),
+        total,
+        count_tokens(compressed, model),
+    )
+    return compressed
@@ -0,0 +1,246 @@
+"""
+Persistent chunk-embedding cache
+--------------------------------
+
+Re-uploads, shared boilerplate pages and the same handout uploaded by many
+students produce identical chunk text. ``CachedEmbeddings`` wraps the real
+embedding model and looks every chunk up by
+
+    sha256(model_name + "\\0" + chunk_text)
+
+in a SQLite table before calling the model, so known content never goes
+through inference again.
+
+The cache is size-bounded: once it holds more than ``max_entries`` rows the
+least recently used ones are evicted in a batch.
+
+Query embeddings are cached separately in memory (``QueryEmbeddingCache``):
+questions are short, hot and repeated, so a small in-process LRU keyed by
+model + whitespace-normalised text skips the forward pass entirely.
+"""
+
+from __future__ import annotations
+
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger("RAG")
+
+# Evict down to this fraction of max_entries so eviction is not run
+# on every insert once the cache is full.
+EVICT_TO_RATIO = 0.9
+
+_SQLITE_MAX_VARS = 900
+
+
+class EmbeddingCache:
+    """
+    SQLite-backed ``key -> float32 vector`` store with LRU eviction.
+    """
+
+    def __init__(self, path: str, max_entries: int) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)"
+        )
+        self._conn.commit()
+
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        now = time.time()
+
+        with self._lock:
+            for i in range(0, len(keys), _SQLITE_MAX_VARS):
+                batch = list(keys[i:i + _SQLITE_MAX_VARS])
+                marks = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({marks})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+
+                if rows:
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE key IN ({marks})",
+                        [now, *batch],
+                    )
+            self._conn.commit()
+
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        if not items:
+            return
+
+        now = time.time()
+        rows = [
+            (key, np.asarray(vec, dtype=np.float32).tobytes(), now)
+            for key, vec in items.items()
+        ]
+
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                rows,
+            )
+            self._count += self._conn.total_changes - before
+
+            if self._count > self.max_entries:
+                self._evict()
+
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        target = int(self.max_entries * EVICT_TO_RATIO)
+        excess = self._count - target
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN ("
+            " SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+            (excess,),
+        )
+        self._count = target
+        logger.info("[RAG] Embedding cache evicted | rows=%d", excess)
+
+    def __len__(self) -> int:
+        return self._count
+
+
+class QueryEmbeddingCache:
+    """
+    Bounded, thread-safe in-memory LRU of query vectors.
+    """
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.split())
+
+    def get(self, model_name: str, text: str) -> Optional[List[float]]:
+        key = (model_name, self.normalize(text))
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(vector)
+
+    def put(self, model_name: str, text: str, vector: List[float]) -> None:
+        if self.max_entries <= 0:
+            return
+        key = (model_name, self.normalize(text))
+        with self._lock:
+            self._entries[key] = list(vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    ``Embeddings`` wrapper that consults ``EmbeddingCache`` before
+    running the underlying model on document chunks, and
+    ``QueryEmbeddingCache`` (if given) for queries.
+    """
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        cache: EmbeddingCache,
+        model_name: Optional[str] = None,
+        query_cache: Optional[QueryEmbeddingCache] = None,
+    ) -> None:
+        self.underlying = underlying
+        self.cache = cache
+        self.query_cache = query_cache
+        self.model_name = model_name or getattr(
+            underlying, "model_name", type(underlying).__name__
+        )
+
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(t) for t in texts]
+        cached = self.cache.get_many(list(set(keys)))
+
+        # Embed each unseen text once, even if it repeats in this batch
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(fresh)
+            cached.update(fresh)
+
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        logger.info(
+            "[RAG] Embedding cache | chunks=%d hits=%d embedded=%d",
+            len(texts),
+            len(texts) - len(missing),
+            len(missing),
+        )
+
+        return [list(cached[k]) for k in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.query_cache is None:
+            return self.underlying.embed_query(text)
+
+        vector = self.query_cache.get(self.model_name, text)
+        if vector is None:
+            vector = self.underlying.embed_query(QueryEmbeddingCache.normalize(text))
+            self.query_cache.put(self.model_name, text, vector)
+        return vector
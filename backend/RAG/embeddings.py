@@ -0,0 +1,254 @@
+"""
+Embedding backends
+------------------
+
+Embedding is the dominant CPU cost of both ingest and every query.
+``build_embeddings()`` returns a LangChain ``Embeddings`` for one of:
+
+- "hf"         sentence-transformers (PyTorch, fp32) — the reference
+- "onnx"       same model exported to ONNX, run by onnxruntime
+- "onnx-int8"  ONNX model with dynamically quantized int8 weights
+
+All backends use the same tokenizer, mean pooling and L2 normalisation
+as the sentence-transformers pipeline, so vectors stay interchangeable.
+``check_parity()`` compares a candidate backend against the reference on
+a fixed sample; a backend that drifts is rejected at startup.
+
+onnxruntime is optional and only imported when an ONNX backend is chosen.
+"""
+
+from __future__ import annotations
+
+import os
+import logging
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from langchain_core.embeddings import Embeddings
+from langchain_huggingface import HuggingFaceEmbeddings
+
+logger = logging.getLogger("RAG")
+
+BACKENDS = ("hf", "onnx", "onnx-int8")
+
+# sentence-transformers default for all-MiniLM-L6-v2
+MAX_SEQ_LENGTH = 256
+
+PARITY_MIN_COSINE = 0.99
+
+PARITY_SAMPLE = (
+    "What is the time complexity of binary search?",
+    "Photosynthesis converts light energy into chemical energy.",
+    "ERROR 1045 (28000): Access denied for user 'root'@'localhost'",
+    "The French Revolution began in 1789.",
+    "def fibonacci(n): return n if n < 2 else fibonacci(n - 1) + fibonacci(n - 2)",
+    "Normalization reduces redundancy in relational database design.",
+    "A short one.",
+    "Interview question: explain the difference between a process and a thread "
+    "and when you would prefer one over the other in a web server.",
+)
+
+# ==================================================
+# ONNX BACKEND
+# ==================================================
+
+class OnnxEmbeddings(Embeddings):
+    """
+    sentence-transformers compatible embeddings on onnxruntime.
+
+    Texts are sorted by length before batching so each batch pads to a
+    similar length, then restored to input order.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        *,
+        quantize: bool = False,
+        batch_size: int = 32,
+        threads: Optional[int] = None,
+        cache_dir: str = "rag_data/models",
+    ) -> None:
+        try:
+            import onnxruntime as ort
+            from huggingface_hub import hf_hub_download
+            from transformers import AutoTokenizer
+        except ImportError as exc:
+            raise RuntimeError(
+                "ONNX embedding backend requires onnxruntime and transformers"
+            ) from exc
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+
+        model_path = hf_hub_download(repo_id=model_name, filename="onnx/model.onnx")
+
+        if quantize:
+            model_path = self._quantized_copy(model_path, model_name, cache_dir)
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        self.session = ort.InferenceSession(
+            model_path,
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+        logger.info(
+            "[RAG] ONNX embeddings ready | model=%s int8=%s batch=%d threads=%s",
+            model_name,
+            quantize,
+            batch_size,
+            threads,
+        )
+
+    @staticmethod
+    def _quantized_copy(model_path: str, model_name: str, cache_dir: str) -> str:
+        """Dynamically quantize weights to int8 once and reuse the file."""
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        os.makedirs(cache_dir, exist_ok=True)
+        target = os.path.join(cache_dir, model_name.replace("/", "__") + ".int8.onnx")
+
+        if not os.path.exists(target):
+            tmp = target + ".tmp"
+            quantize_dynamic(model_path, tmp, weight_type=QuantType.QInt8)
+            os.replace(tmp, target)
+            logger.info("[RAG] Quantized embedding model written | path=%s", target)
+
+        return target
+
+    def _encode_batch(self, texts: Sequence[str]) -> np.ndarray:
+        enc = self.tokenizer(
+            list(texts),
+            padding=True,
+            truncation=True,
+            max_length=MAX_SEQ_LENGTH,
+            return_tensors="np",
+        )
+        feeds = {k: v.astype(np.int64) for k, v in enc.items() if k in self.input_names}
+        token_embeddings = self.session.run(None, feeds)[0]
+
+        # Mean pooling over real tokens, then L2 normalise
+        mask = enc["attention_mask"][..., None].astype(np.float32)
+        summed = (token_embeddings * mask).sum(axis=1)
+        pooled = summed / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return pooled / np.clip(norms, 1e-12, None)
+
+    def _encode(self, texts: Sequence[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        out: List[Optional[np.ndarray]] = [None] * len(texts)
+
+        for start in range(0, len(order), self.batch_size):
+            idx = order[start:start + self.batch_size]
+            vectors = self._encode_batch([texts[i] for i in idx])
+            for i, v in zip(idx, vectors):
+                out[i] = v
+
+        return np.vstack(out).astype(np.float32)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([text])[0].tolist()
+
+# ==================================================
+# FACTORY + PARITY
+# ==================================================
+
+def build_embeddings(
+    model_name: str,
+    *,
+    backend: str = "hf",
+    batch_size: int = 32,
+    threads: Optional[int] = None,
+) -> Embeddings:
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+
+    if backend == "hf":
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+
+        return HuggingFaceEmbeddings(
+            model_name=model_name,
+            model_kwargs={"device": "cpu"},
+            encode_kwargs={"batch_size": batch_size},
+        )
+
+    return OnnxEmbeddings(
+        model_name,
+        quantize=backend == "onnx-int8",
+        batch_size=batch_size,
+        threads=threads,
+    )
+
+
+def check_parity(
+    reference: Embeddings,
+    candidate: Embeddings,
+    texts: Sequence[str] = PARITY_SAMPLE,
+) -> float:
+    """
+    Minimum cosine similarity between reference and candidate vectors
+    for the same texts (1.0 = identical direction).
+    """
+    ref = np.asarray(reference.embed_documents(list(texts)), dtype=np.float32)
+    cand = np.asarray(candidate.embed_documents(list(texts)), dtype=np.float32)
+
+    ref /= np.clip(np.linalg.norm(ref, axis=1, keepdims=True), 1e-12, None)
+    cand /= np.clip(np.linalg.norm(cand, axis=1, keepdims=True), 1e-12, None)
+
+    return float((ref * cand).sum(axis=1).min())
+
+
+def load_embeddings(
+    model_name: str,
+    *,
+    backend: str,
+    batch_size: int,
+    threads: Optional[int],
+    verify_parity: bool,
+) -> Tuple[Embeddings, str]:
+    """
+    Build the configured backend; optionally verify it against the
+    fp32 reference and fall back to the reference if it drifts.
+
+    Returns the embeddings and the backend actually in use ("hf" after
+    a fallback).
+    """
+    candidate = build_embeddings(
+        model_name,
+        backend=backend,
+        batch_size=batch_size,
+        threads=threads,
+    )
+
+    if backend == "hf" or not verify_parity:
+        return candidate, backend
+
+    reference = build_embeddings(model_name, backend="hf", batch_size=batch_size, threads=threads)
+    cosine = check_parity(reference, candidate)
+
+    if cosine < PARITY_MIN_COSINE:
+        logger.error(
+            "[RAG] Embedding backend failed parity, using hf | backend=%s min_cosine=%.4f",
+            backend,
+            cosine,
+        )
+        return reference, "hf"
+
+    logger.info("[RAG] Embedding parity ok | backend=%s min_cosine=%.4f", backend, cosine)
+    return candidate, backend
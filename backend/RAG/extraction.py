@@ -0,0 +1,408 @@
+"""
+PDF / image text extraction
+---------------------------
+
+Page-wise extraction with OCR fallback, spread across a process pool.
+
+- Pages are split into contiguous ranges (a few pages; larger for long
+  documents so re-opening the PDF stays cheap), each handled by a worker
+  process that opens the PDF itself (PyMuPDF documents are not picklable)
+- Results are yielded in page order as they arrive (``iter_pdf_pages``),
+  with a bounded number of ranges in flight
+- Each document gets a wall-clock budget; pages that miss it come back
+  empty instead of holding the upload forever
+
+OCR is adaptive:
+
+- blank / low-ink pages are detected on a cheap grayscale thumbnail and
+  skipped
+- the render DPI follows the measured text-line height (small print gets
+  more pixels) and is capped by page area
+- pages are rendered and OCR'd in grayscale
+- with ``tesserocr`` installed, each worker keeps one libtesseract engine
+  alive instead of starting a tesseract subprocess per page
+
+Per-document OCR counts, skip rate and per-page OCR time are logged and
+returned through ``stats``.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Iterator, List, Optional
+
+import fitz  # PyMuPDF
+import numpy as np
+import pytesseract
+from PIL import Image
+
+try:
+    # Optional: in-process libtesseract (one engine per worker thread)
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+logger = logging.getLogger("RAG")
+
+# ==================================================
+# CONFIG
+# ==================================================
+
+OCR_MIN_TEXT_CHARS = 50
+OCR_WORKERS = int(os.getenv("RAG_OCR_WORKERS", str(os.cpu_count() or 1)))
+PAGES_PER_TASK = int(os.getenv("RAG_PAGES_PER_TASK", "4"))  # minimum range size
+TASKS_PER_WORKER = 16
+EXTRACTION_BUDGET_S = float(os.getenv("RAG_EXTRACTION_BUDGET_S", "600"))
+OCR_NICE = int(os.getenv("RAG_OCR_NICE", "10"))
+# Page ranges in flight or awaiting the consumer (bounds extracted text
+# held in memory when streaming)
+EXTRACT_WINDOW = int(os.getenv("RAG_EXTRACT_WINDOW", str(2 * OCR_WORKERS)))
+OCR_LANG = os.getenv("RAG_OCR_LANG", "eng")
+
+# Blank-page detection on a 72 DPI grayscale thumbnail
+INK_LEVEL = 200            # pixels darker than this count as ink
+BLANK_INK_RATIO = 0.0005   # below this share of ink pixels: skip OCR
+
+# Render DPI from the median text-line height (px at 72 DPI ~ points)
+OCR_DPI_SMALL_PRINT = 300  # lines < 9 px (footnotes, dense scans)
+OCR_DPI_DEFAULT = 200      # lines < 16 px
+OCR_DPI_LARGE_PRINT = 150
+OCR_MAX_PIXELS = 12_000_000
+
+# ==================================================
+# PAGE EXTRACTION (RUNS IN WORKERS)
+# ==================================================
+
+_ENGINE = threading.local()
+# Set in a worker whose libtesseract engine failed to start (missing
+# tessdata / language pack); it then OCRs through pytesseract
+_ENGINE_FAILED = False
+
+
+def _ocr_engine():
+    """This thread's libtesseract engine, or None to use pytesseract."""
+    global _ENGINE_FAILED
+    if tesserocr is None or _ENGINE_FAILED:
+        return None
+    engine = getattr(_ENGINE, "api", None)
+    if engine is None:
+        try:
+            engine = tesserocr.PyTessBaseAPI(lang=OCR_LANG)
+        except RuntimeError as exc:
+            _ENGINE_FAILED = True
+            logger.warning(
+                "[RAG] tesserocr engine unavailable, using pytesseract | lang=%s error=%s",
+                OCR_LANG,
+                exc,
+            )
+            return None
+        _ENGINE.api = engine
+    return engine
+
+
+def _ocr_image(img: Image.Image, dpi: Optional[int] = None) -> str:
+    engine = _ocr_engine()
+    if engine is not None:
+        engine.SetImage(img)
+        if dpi:
+            engine.SetSourceResolution(dpi)
+        return engine.GetUTF8Text().strip()
+
+    config = f"--dpi {dpi}" if dpi else ""
+    return pytesseract.image_to_string(img, lang=OCR_LANG, config=config).strip()
+
+
+def _new_stats() -> Dict[str, float]:
+    return {"pages": 0, "text_layer": 0, "ocr": 0, "blank_skipped": 0, "ocr_seconds": 0.0}
+
+
+def _merge_stats(total: Dict[str, float], part: Dict[str, float]) -> None:
+    for key, value in part.items():
+        total[key] = total.get(key, 0) + value
+
+
+def _ocr_plan(page: fitz.Page) -> Optional[int]:
+    """
+    Render DPI for OCR, or None when the page is blank / low-ink.
+    """
+    # Nothing drawn at all: no need to render. get_image_info() also
+    # lists inline images, which is how many scanners store a page
+    if not page.get_image_info() and not page.get_drawings():
+        return None
+
+    thumb = page.get_pixmap(colorspace=fitz.csGRAY, alpha=False)
+    pixels = np.frombuffer(thumb.samples, dtype=np.uint8).reshape(thumb.height, thumb.width)
+    ink = pixels < INK_LEVEL
+
+    ink_pixels = int(ink.sum())
+    if ink_pixels < BLANK_INK_RATIO * ink.size:
+        return None
+
+    # Text lines = runs of rows containing ink; their height ~ font size
+    rows = np.concatenate(([False], ink.any(axis=1), [False]))
+    edges = np.flatnonzero(rows[1:] != rows[:-1])
+    line_px = float(np.median(edges[1::2] - edges[::2]))
+
+    if line_px < 9:
+        dpi = OCR_DPI_SMALL_PRINT
+    elif line_px < 16:
+        dpi = OCR_DPI_DEFAULT
+    else:
+        dpi = OCR_DPI_LARGE_PRINT
+
+    # Cap pixel count for oversized pages (posters, scans at A3+)
+    area_in2 = (page.rect.width / 72) * (page.rect.height / 72)
+    max_dpi = int((OCR_MAX_PIXELS / max(area_in2, 1e-6)) ** 0.5)
+    return max(72, min(dpi, max_dpi))
+
+
+def _extract_page(page: fitz.Page, stats: Optional[Dict[str, float]] = None) -> str:
+    stats = stats if stats is not None else _new_stats()
+    stats["pages"] += 1
+
+    text = page.get_text().strip()
+    if len(text) >= OCR_MIN_TEXT_CHARS:
+        stats["text_layer"] += 1
+        return text
+
+    dpi = _ocr_plan(page)
+    if dpi is None:
+        stats["blank_skipped"] += 1
+        return text
+
+    started = time.perf_counter()
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+    img = Image.frombytes("L", [pix.width, pix.height], pix.samples)
+    ocr_text = _ocr_image(img, dpi)
+    elapsed = time.perf_counter() - started
+
+    stats["ocr"] += 1
+    stats["ocr_seconds"] += elapsed
+
+    logger.info(
+        "[RAG] OCR page | page=%d dpi=%d ms=%.0f",
+        page.number + 1,
+        dpi,
+        elapsed * 1000,
+    )
+
+    # Keep whatever the text layer had if OCR finds less
+    return ocr_text if len(ocr_text) >= len(text) else text
+
+
+def _extract_page_range(path: str, start: int, stop: int):
+    stats = _new_stats()
+    with fitz.open(path) as doc:
+        texts = [_extract_page(doc[n], stats) for n in range(start, stop)]
+    return texts, stats
+
+# ==================================================
+# PROCESS POOL (SHARED, LAZY)
+# ==================================================
+
+_POOL: Optional[ProcessPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+
+
+def _init_worker() -> None:
+    # OCR is background work; keep interactive requests responsive
+    if OCR_NICE and hasattr(os, "nice"):
+        os.nice(OCR_NICE)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """
+    One pool for the whole process.
+
+    Workers are forked where possible: "spawn" re-runs app.py in every
+    child (DB init, embedding model load). Children only touch PyMuPDF
+    and tesseract, never the parent's FAISS / torch state.
+    """
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+            _POOL = ProcessPoolExecutor(
+                max_workers=OCR_WORKERS,
+                mp_context=multiprocessing.get_context(method),
+                initializer=_init_worker,
+            )
+        return _POOL
+
+
+def shutdown_pool() -> None:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown(wait=False, cancel_futures=True)
+            _POOL = None
+
+
+def _log_stats(path: str, stats: Dict[str, float]) -> None:
+    pages = stats["pages"]
+    ocr = stats["ocr"]
+    skipped = stats["blank_skipped"]
+    candidates = ocr + skipped
+
+    logger.info(
+        "[RAG] Extraction stats | path=%s pages=%d text_layer=%d ocr=%d "
+        "blank_skipped=%d skip_rate=%.2f ocr_ms_avg=%.0f",
+        path,
+        pages,
+        stats["text_layer"],
+        ocr,
+        skipped,
+        skipped / candidates if candidates else 0.0,
+        stats["ocr_seconds"] * 1000 / ocr if ocr else 0.0,
+    )
+
+# ==================================================
+# PUBLIC API
+# ==================================================
+
+def pdf_page_count(path: str) -> int:
+    with fitz.open(path) as doc:
+        return doc.page_count
+
+
+def iter_pdf_pages(
+    path: str,
+    budget_s: Optional[float] = None,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    stats: Optional[Dict[str, float]] = None,
+) -> Iterator[str]:
+    """
+    Yield the text of every page, in page order, as it becomes available.
+
+    At most EXTRACT_WINDOW page ranges are in flight or waiting to be
+    consumed, so a slow consumer (embedding) holds the workers back
+    instead of letting extracted text pile up in memory.
+
+    ``on_progress(pages_done, page_count)`` is called from the consuming
+    thread as pages are yielded. ``stats`` (if given) is filled with page
+    counts per path (text layer / OCR / blank skipped) and OCR seconds.
+
+    Small documents (or OCR_WORKERS <= 1) are handled inline; the
+    pool only pays off once there is more than one task to spread.
+    Pages that miss the budget come back empty.
+    """
+    budget = EXTRACTION_BUDGET_S if budget_s is None else budget_s
+    deadline = time.monotonic() + budget
+    stats = stats if stats is not None else {}
+    stats.update(_new_stats())
+
+    with fitz.open(path) as doc:
+        page_count = doc.page_count
+
+        if OCR_WORKERS <= 1 or page_count <= PAGES_PER_TASK:
+            done = 0
+            for page in doc:
+                if time.monotonic() > deadline:
+                    logger.warning(
+                        "[RAG] Extraction budget exceeded | path=%s pages_done=%d/%d",
+                        path,
+                        done,
+                        page_count,
+                    )
+                    break
+                yield _extract_page(page, stats)
+                done += 1
+                if on_progress:
+                    on_progress(done, page_count)
+
+            _log_stats(path, stats)
+            for _ in range(page_count - done):
+                yield ""
+            return
+
+    # Every task re-opens the PDF; on long documents use fewer, larger
+    # ranges so that cost stays per-range rather than per few pages.
+    span = max(PAGES_PER_TASK, page_count // (OCR_WORKERS * TASKS_PER_WORKER))
+    starts = list(range(0, page_count, span))
+    window = max(2, EXTRACT_WINDOW)
+    pool = _get_pool()
+
+    pending: Dict[Future, int] = {}
+    ready: Dict[int, List[str]] = {}
+    submitted = 0
+    emitted = 0
+    pages_done = 0
+
+    try:
+        while emitted < len(starts):
+            while submitted < len(starts) and len(pending) + len(ready) < window:
+                start = starts[submitted]
+                fut = pool.submit(_extract_page_range, path, start, min(start + span, page_count))
+                pending[fut] = start
+                submitted += 1
+
+            start = starts[emitted]
+            if start in ready:
+                for text in ready.pop(start):
+                    yield text
+                    pages_done += 1
+                emitted += 1
+                if on_progress:
+                    on_progress(pages_done, page_count)
+                continue
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for fut in done:
+                start = pending.pop(fut)
+                try:
+                    texts, part = fut.result()
+                except BrokenProcessPool:
+                    # A worker died (OOM, segfault in a malformed page);
+                    # drop the pool so the next document gets a fresh one.
+                    shutdown_pool()
+                    raise
+                ready[start] = texts
+                _merge_stats(stats, part)
+    finally:
+        for fut in pending:
+            fut.cancel()
+
+    if emitted < len(starts):
+        missing = [start for start in starts[emitted:] if start not in ready]
+        logger.warning(
+            "[RAG] Extraction budget exceeded | path=%s budget=%.0fs missing_ranges=%d",
+            path,
+            budget,
+            len(missing),
+        )
+        # Ranges finished out of order are kept; the rest come back empty
+        for start in starts[emitted:]:
+            texts = ready.pop(start, None)
+            if texts is None:
+                texts = [""] * (min(start + span, page_count) - start)
+            yield from texts
+
+    _log_stats(path, stats)
+
+
+def extract_pdf_text_pagewise(
+    path: str,
+    budget_s: Optional[float] = None,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    stats: Optional[Dict[str, float]] = None,
+) -> List[str]:
+    """
+    Extract text for every page, in page order (see ``iter_pdf_pages``).
+    """
+    return list(iter_pdf_pages(path, budget_s, on_progress, stats))
+
+
+def extract_image_text(path: str) -> List[str]:
+    img = Image.open(path)
+    text = _ocr_image(img)
+    return [text] if text else []
@@ -3,13 +3,19 @@ Production-Grade RAG Engine (PDF + Images + Chat)
 -------------------------------------------------
 
 Capabilities:
-- PDF ingestion with OCR fallback
+- PDF ingestion with OCR fallback (parallel, time-budgeted), pipelined
+  into embedding with bounded memory
 - Image ingestion (PNG/JPG/JPEG via OCR)
-- Page-wise raw text extraction & persistence
-- FAISS-based semantic retrieval
+- Page-wise raw text extraction & persistence (paged, mmap-readable)
+- Hybrid retrieval: FAISS (one shard per user) + per-document BM25
+- Multi-document questions over a list of files or a named collection
+  (scopes searched in parallel, merged with per-file quotas)
 - Full-document extraction mode
 - Question extraction mode
-- Document-grounded Q&A
+- Document-grounded Q&A (answers cached per document version)
+- Token-budgeted context: MMR diversity + overlap merging, optionally
+  compressed to the sentences closest to the question
+- Token-streamed answers; full documents streamed page by page
 - General-knowledge fallback
 
 CRITICAL GUARANTEE:
@@ -25,18 +31,28 @@ from __future__ import annotations
 
 import os
 import json
+import queue
 import logging
-from typing import List, Dict, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Dict, Optional, Sequence, Tuple
 
-import fitz  # PyMuPDF
-import pytesseract
-from PIL import Image
+import numpy as np
 import requests
 
 from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
+
+from RAG.answer_cache import AnswerCache
+from RAG.collection_store import CollectionStore
+from RAG.content_store import ContentStore
+from RAG.context_builder import compress_context, context_budget, pack_context
+from RAG.embedding_cache import CachedEmbeddings, EmbeddingCache, QueryEmbeddingCache
+from RAG.embeddings import load_embeddings
+from RAG.extraction import extract_image_text, iter_pdf_pages, pdf_page_count
+from RAG.raw_text_store import PageWriter, page_count, read_pages, write_pages
+from RAG.sparse_index import BM25Builder, BM25Index, SparseIndexStore
+from RAG.vector_shards import ShardRegistry, shard_key
 
 # ==================================================
 # LOGGING
@@ -58,13 +74,39 @@ OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
 DATA_DIR = "rag_data"
 VECTOR_DIR = os.path.join(DATA_DIR, "faiss")
 RAW_TEXT_DIR = os.path.join(DATA_DIR, "raw_text")
+SPARSE_DIR = os.path.join(DATA_DIR, "sparse")
+CONTENT_DIR = os.path.join(DATA_DIR, "content")
 
 os.makedirs(VECTOR_DIR, exist_ok=True)
 os.makedirs(RAW_TEXT_DIR, exist_ok=True)
 
 TOP_K = 6
-MAX_CONTEXT_CHARS = 18_000
+# Chunks retrieved for answering; context packing picks within the budget
+CONTEXT_CANDIDATES = 2 * TOP_K
+# Optional extractive sentence selection before the LLM call (query
+# vector is already cached from retrieval; sentence vectors go through a
+# small in-memory LRU, never the persistent chunk cache)
+CONTEXT_COMPRESSION = os.getenv("RAG_CONTEXT_COMPRESSION", "0") == "1"
+INGEST_BATCH_SIZE = 256  # chunks embedded per progress step
+# Chunk batches buffered between extraction/splitting and embedding
+INGEST_QUEUE_BATCHES = int(os.getenv("RAG_INGEST_QUEUE_BATCHES", "2"))
+# Staged batches are written to a shard segment every this many batches,
+# so unsaved vectors of a large document do not pile up in memory
+INGEST_SAVE_BATCHES = 16
 MAX_FULLDOC_PAGES = 200
+FULLDOC_STREAM_PAGES = 8  # pages read per slice when streaming a full document
+
+# Hybrid retrieval: candidates pulled from each side, and the weight of
+# the dense score in the fused ranking (1 - HYBRID_ALPHA goes to BM25)
+HYBRID_FETCH_K = 20
+HYBRID_ALPHA = 0.5
+
+# Multi-document questions: files searched concurrently
+MULTI_SCOPE_WORKERS = int(os.getenv("RAG_MULTI_SCOPE_WORKERS", "8"))
+
+# Grounded answers per (document version, question)
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("RAG_ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL_S = float(os.getenv("RAG_ANSWER_CACHE_TTL_S", "3600"))
 
 CHAT_MODEL = "meta-llama/llama-3-8b-instruct"
 
@@ -72,128 +114,159 @@ CHAT_MODEL = "meta-llama/llama-3-8b-instruct"
 # EMBEDDINGS & SPLITTER
 # ==================================================
 
-EMBEDDINGS = HuggingFaceEmbeddings(
-    model_name="sentence-transformers/all-MiniLM-L6-v2",
-    model_kwargs={"device": "cpu"},
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Backend: "hf" (fp32 reference) | "onnx" | "onnx-int8"
+EMBEDDING_BACKEND = os.getenv("RAG_EMBEDDING_BACKEND", "hf")
+EMBEDDING_BATCH_SIZE = int(os.getenv("RAG_EMBEDDING_BATCH_SIZE", "32"))
+EMBEDDING_THREADS = int(os.getenv("RAG_EMBEDDING_THREADS", "0")) or None
+EMBEDDING_PARITY_CHECK = os.getenv("RAG_EMBEDDING_PARITY_CHECK", "1") == "1"
+
+# EMBEDDING_BACKEND_USED is "hf" when the configured backend failed parity
+EMBEDDINGS, EMBEDDING_BACKEND_USED = load_embeddings(
+    EMBEDDING_MODEL,
+    backend=EMBEDDING_BACKEND,
+    batch_size=EMBEDDING_BATCH_SIZE,
+    threads=EMBEDDING_THREADS,
+    verify_parity=EMBEDDING_PARITY_CHECK,
 )
 
-SPLITTER = RecursiveCharacterTextSplitter(
-    chunk_size=1000,
-    chunk_overlap=200,
+# Chunk embeddings go through a persistent content-hash cache so
+# re-uploaded / shared text never hits the model twice. Repeated
+# questions are served from an in-memory LRU of query vectors.
+EMBEDDING_CACHE_PATH = os.path.join(DATA_DIR, "embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = 200_000
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("RAG_QUERY_CACHE_SIZE", "2048"))
+SENTENCE_CACHE_MAX_ENTRIES = int(os.getenv("RAG_SENTENCE_CACHE_SIZE", "4096"))
+
+CACHED_EMBEDDINGS = CachedEmbeddings(
+    EMBEDDINGS,
+    EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES),
+    model_name=(
+        EMBEDDING_MODEL
+        if EMBEDDING_BACKEND_USED == "hf"
+        else f"{EMBEDDING_MODEL}@{EMBEDDING_BACKEND_USED}"
+    ),
+    query_cache=QueryEmbeddingCache(QUERY_CACHE_MAX_ENTRIES),
 )
 
-# ==================================================
-# VECTOR STORE (SINGLE GLOBAL INDEX)
-# ==================================================
+# Context sentences for compression: short-lived, so kept out of the
+# persistent chunk cache where they would evict real chunk vectors
+SENTENCE_CACHE = QueryEmbeddingCache(SENTENCE_CACHE_MAX_ENTRIES)
 
-VECTOR_STORE: Optional[FAISS] = None
 
-
-def load_vector_store() -> None:
-    global VECTOR_STORE
-    index_path = os.path.join(VECTOR_DIR, "index.faiss")
-    if os.path.exists(index_path):
-        VECTOR_STORE = FAISS.load_local(
-            VECTOR_DIR,
-            EMBEDDINGS,
-            allow_dangerous_deserialization=True,
-        )
-        logger.info("[RAG] FAISS index loaded")
+def _embed_sentences(texts: List[str]) -> List[List[float]]:
+    model = CACHED_EMBEDDINGS.model_name
+    vectors = [SENTENCE_CACHE.get(model, t) for t in texts]
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    if missing:
+        fresh = EMBEDDINGS.embed_documents([texts[i] for i in missing])
+        for i, vector in zip(missing, fresh):
+            SENTENCE_CACHE.put(model, texts[i], vector)
+            vectors[i] = vector
+    return vectors
 
 
-def save_vector_store() -> None:
-    if VECTOR_STORE is not None:
-        VECTOR_STORE.save_local(VECTOR_DIR)
-        logger.info("[RAG] FAISS index saved")
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
 
+SPLITTER = RecursiveCharacterTextSplitter(
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=CHUNK_OVERLAP,
+)
 
-load_vector_store()
+# Byte-identical uploads reuse extraction + embeddings (same model and
+# chunking only)
+CONTENT = ContentStore(
+    CONTENT_DIR,
+    model_key=f"{CACHED_EMBEDDINGS.model_name}|{CHUNK_SIZE}/{CHUNK_OVERLAP}",
+)
 
 # ==================================================
-# OCR / EXTRACTION
+# VECTOR STORE (ONE SHARD PER USER)
 # ==================================================
 
-def _ocr_image(img: Image.Image) -> str:
-    return pytesseract.image_to_string(img).strip()
-
-
-def extract_pdf_text_pagewise(path: str) -> List[str]:
-    pages: List[str] = []
+SHARDS = ShardRegistry(VECTOR_DIR, CACHED_EMBEDDINGS)
 
-    with fitz.open(path) as doc:
-        for page in doc:
-            text = page.get_text().strip()
+# Per-document BM25 indexes, built from the same chunks at ingest
+SPARSE = SparseIndexStore(SPARSE_DIR)
 
-            if len(text) < 50:
-                logger.info("[RAG] OCR fallback on page %d", page.number + 1)
-                pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-                img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                text = _ocr_image(img)
+ANSWERS = AnswerCache(ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_S)
 
-            pages.append(text.strip())
+# Named sets of file_ids, queried as one scope
+COLLECTIONS = CollectionStore(os.path.join(DATA_DIR, "collections.sqlite3"))
 
-    return pages
-
-
-def extract_image_text(path: str) -> List[str]:
-    img = Image.open(path)
-    text = _ocr_image(img)
-    return [text] if text else []
+# FAISS / numpy release the GIL, so per-file searches overlap
+_SCOPE_POOL = ThreadPoolExecutor(max_workers=MULTI_SCOPE_WORKERS, thread_name_prefix="rag-scope")
 
 # ==================================================
 # RAW TEXT STORAGE
 # ==================================================
 
+RAW_TEXT_COMPRESS = os.getenv("RAG_RAW_TEXT_COMPRESS", "1") == "1"
+
+
 def _raw_text_path(file_id: str) -> str:
+    return os.path.join(RAW_TEXT_DIR, f"{file_id}.pages")
+
+
+def _legacy_raw_text_path(file_id: str) -> str:
     return os.path.join(RAW_TEXT_DIR, f"{file_id}.json")
 
 
 def save_raw_text(file_id: str, pages: List[str]) -> None:
-    payload = [{"page": i + 1, "text": t} for i, t in enumerate(pages)]
-    with open(_raw_text_path(file_id), "w", encoding="utf-8") as f:
-        json.dump(payload, f, ensure_ascii=False, indent=2)
+    write_pages(_raw_text_path(file_id), pages, compress=RAW_TEXT_COMPRESS)
 
     logger.info("[RAG] Raw text saved | file=%s pages=%d", file_id, len(pages))
 
 
-def load_raw_text(file_id: str) -> List[Dict]:
+def load_raw_text(file_id: str, offset: int = 0, limit: Optional[int] = None) -> List[Dict]:
+    """
+    Page-wise text for ``file_id``; ``offset``/``limit`` select a page
+    range without reading the rest of the document.
+    """
     path = _raw_text_path(file_id)
-    if not os.path.exists(path):
+    if os.path.exists(path):
+        return read_pages(path, offset, limit)
+
+    # Documents ingested before the paged store
+    legacy = _legacy_raw_text_path(file_id)
+    if not os.path.exists(legacy):
         return []
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    with open(legacy, "r", encoding="utf-8") as f:
+        pages = json.load(f)
+    return pages[offset:] if limit is None else pages[offset:offset + limit]
+
+
+def raw_text_page_count(file_id: str) -> int:
+    path = _raw_text_path(file_id)
+    if os.path.exists(path):
+        return page_count(path)
+    return len(load_raw_text(file_id))
 
 # ==================================================
 # INGESTION (PDF / IMAGE)
 # ==================================================
 
-def ingest_file(*, file_id: str, file_path: str, mimetype: Optional[str] = None) -> None:
-    """
-    Authoritative ingestion entry point.
-    Called by Files page and Chat page.
-    """
-    global VECTOR_STORE
-
-    logger.info("[RAG] Ingesting | file=%s path=%s", file_id, file_path)
-
-    ext = os.path.splitext(file_path)[1].lower()
-
-    if ext in {".png", ".jpg", ".jpeg"}:
-        pages = extract_image_text(file_path)
-    else:
-        pages = extract_pdf_text_pagewise(file_path)
-
-    if not any(pages):
-        raise ValueError("No text extracted from document")
+_END = object()
 
-    # Persist raw text FIRST (authoritative)
-    save_raw_text(file_id, pages)
 
-    docs: List[Document] = []
+def _chunk_batches(
+    file_id: str,
+    pages: Iterable[str],
+    writer: PageWriter,
+) -> Iterator[Tuple[int, List[Document]]]:
+    """
+    Persist each page's raw text as it arrives and yield
+    ``(pages_done, chunks)`` in batches of INGEST_BATCH_SIZE.
+    """
+    batch: List[Document] = []
+    page_num = 0
 
     for page_num, text in enumerate(pages, start=1):
+        writer.add(text)
         for chunk in SPLITTER.split_text(text):
-            docs.append(
+            batch.append(
                 Document(
                     page_content=chunk,
                     metadata={
@@ -202,62 +275,250 @@ def ingest_file(*, file_id: str, file_path: str, mimetype: Optional[str] = None)
                     },
                 )
             )
+            if len(batch) >= INGEST_BATCH_SIZE:
+                yield page_num, batch
+                batch = []
 
-    if VECTOR_STORE is None:
-        VECTOR_STORE = FAISS.from_documents(docs, EMBEDDINGS)
-    else:
-        VECTOR_STORE.add_documents(docs)
+    if batch:
+        yield page_num, batch
+
+
+def _embed_pipelined(
+    shard,
+    batches: Iterator[Tuple[int, List[Document]]],
+    on_batch: Callable[[int, List[Document], np.ndarray], None],
+) -> int:
+    """
+    Extract + split (``batches``) in a producer thread while this thread
+    embeds, with at most INGEST_QUEUE_BATCHES batches waiting in between.
+
+    Each embedded batch is handed to ``on_batch(pages_done, chunks,
+    vectors)`` and then dropped, so memory stays bounded by batch sizes
+    and the queue depth rather than the document. Returns the number of
+    chunks embedded.
+    """
+    handoff: "queue.Queue" = queue.Queue(maxsize=max(1, INGEST_QUEUE_BATCHES))
+    stop = threading.Event()
+    failure: List[BaseException] = []
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                handoff.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in batches:
+                if not put(item):
+                    return
+        except BaseException as exc:
+            failure.append(exc)
+        finally:
+            # Cancels in-flight extraction if we stopped early
+            close = getattr(batches, "close", None)
+            if close is not None:
+                close()
+            put(_END)
+
+    producer = threading.Thread(target=produce, name="rag-ingest-extract", daemon=True)
+    producer.start()
+
+    chunks = 0
+    try:
+        while True:
+            item = handoff.get()
+            if item is _END:
+                break
+            pages_done, batch = item
+            on_batch(pages_done, batch, shard.embed(batch))
+            chunks += len(batch)
+    finally:
+        stop.set()
+        producer.join()
+
+    if failure:
+        raise failure[0]
+
+    return chunks
+
+
+def ingest_file(
+    *,
+    file_id: str,
+    file_path: str,
+    mimetype: Optional[str] = None,
+    user_id: Optional[str] = None,
+    progress: Optional[Callable[[str, float], None]] = None,
+    content_hash: Optional[str] = None,
+) -> None:
+    """
+    Authoritative ingestion entry point.
+    Called by Files page and Chat page.
+
+    Chunks go into the caller's shard only; other users' indexes
+    are neither loaded nor rewritten.
 
-    save_vector_store()
+    ``progress(stage, fraction)`` is called as the file moves through
+    "extracting" and "embedding" (used by the background job queue).
+
+    ``content_hash`` (SHA-256 of the upload) lets a byte-identical
+    upload reuse stored raw text and vectors: no OCR, no embedding.
+    """
+    report = progress or (lambda stage, fraction: None)
+
+    ANSWERS.invalidate(file_id)
+
+    logger.info("[RAG] Ingesting | file=%s user=%s path=%s", file_id, user_id, file_path)
+
+    shard = SHARDS.get(user_id)
+
+    stored = None
+    if content_hash:
+        # Reference first so a concurrent delete cannot drop the blob
+        CONTENT.add_ref(file_id, content_hash)
+        stored = CONTENT.load(content_hash)
+
+    if stored is not None:
+        texts, page_numbers, vectors = stored
+
+        CONTENT.link_pages(content_hash, _raw_text_path(file_id))
+        docs = [
+            Document(page_content=text, metadata={"file_id": file_id, "page": page})
+            for text, page in zip(texts, page_numbers)
+        ]
+        page_total = raw_text_page_count(file_id)
+        chunk_total = len(docs)
+        report("embedding", 1.0)
+
+        # Publish all chunks at once so concurrent searches never see a
+        # half-indexed document.
+        vector_ids = shard.add_embedded(docs, vectors)
+        shard.save()
+        sparse = BM25Index.build(vector_ids, texts)
+
+        logger.info(
+            "[RAG] Duplicate upload, reusing extraction + vectors | file=%s hash=%s",
+            file_id,
+            content_hash[:12],
+        )
+    else:
+        ext = os.path.splitext(file_path)[1].lower()
+
+        report("extracting", 0.0)
+
+        if ext in {".png", ".jpg", ".jpeg"}:
+            pages: Iterable[str] = extract_image_text(file_path)
+            page_total = len(pages)
+        else:
+            # Pages stream out of the OCR pool in order
+            pages = iter_pdf_pages(file_path)
+            page_total = pdf_page_count(file_path)
+
+        # Extraction, raw-text persistence and splitting overlap with
+        # embedding. Each embedded batch is staged in the shard (hidden
+        # from searches), added to the BM25 postings and the content blob,
+        # then dropped; the document is published in one step at the end,
+        # after its raw text is committed.
+        staged: List[int] = []
+        builder = BM25Builder()
+        blob = CONTENT.writer(content_hash) if content_hash else None
+        batches_done = 0
+
+        def index_batch(pages_done: int, batch: List[Document], vectors: np.ndarray) -> None:
+            nonlocal batches_done
+            ids = shard.stage(batch, vectors)
+            staged.extend(ids)
+
+            texts = [d.page_content for d in batch]
+            builder.add(ids, texts)
+            if blob is not None:
+                blob.add(texts, [d.metadata["page"] for d in batch], vectors)
+
+            batches_done += 1
+            if batches_done % INGEST_SAVE_BATCHES == 0:
+                shard.save()
+            report("embedding", pages_done / max(page_total, 1))
+
+        try:
+            with PageWriter(_raw_text_path(file_id), page_total, compress=RAW_TEXT_COMPRESS) as writer:
+                chunk_total = _embed_pipelined(shard, _chunk_batches(file_id, pages, writer), index_batch)
+
+                if not chunk_total:
+                    raise ValueError("No text extracted from document")
+
+                writer.commit()
+        except BaseException:
+            shard.discard(staged)
+            if blob is not None:
+                blob.abort()
+            raise
+
+        if blob is not None:
+            blob.commit(_raw_text_path(file_id))
+
+        shard.publish(staged)
+        shard.save()
+        sparse = builder.build()
+
+    SPARSE.save(file_id, sparse)
+
+    # Answers given while the document was half-indexed are not reused
+    ANSWERS.invalidate(file_id)
 
     logger.info(
         "[RAG] Ingestion complete | file=%s pages=%d chunks=%d",
         file_id,
-        len(pages),
-        len(docs),
+        page_total,
+        chunk_total,
     )
 
 # ==================================================
 # DELETE / CLEANUP (REQUIRED)
 # ==================================================
 
-def delete_document(*, file_id: str) -> bool:
+def delete_document(*, file_id: str, user_id: Optional[str] = None) -> bool:
     """
     Remove ALL RAG artifacts for a document.
     Safe, idempotent, never crashes caller.
+
+    Vectors are removed by ID (no re-embedding); their index slots
+    are reclaimed by the next background merge.
     """
 
     deleted = False
 
+    ANSWERS.invalidate(file_id)
+
     # ---- raw text ----
-    raw_path = _raw_text_path(file_id)
-    if os.path.exists(raw_path):
-        os.remove(raw_path)
+    for raw_path in (_raw_text_path(file_id), _legacy_raw_text_path(file_id)):
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+            deleted = True
+            logger.info("[RAG] Raw text deleted | file=%s", file_id)
+
+    # ---- keyword index ----
+    if SPARSE.delete(file_id):
         deleted = True
-        logger.info("[RAG] Raw text deleted | file=%s", file_id)
+
+    # ---- shared content blob (last reference only) ----
+    CONTENT.release(file_id)
 
     # ---- vectors ----
-    global VECTOR_STORE
-    if VECTOR_STORE is not None:
-        docs = list(VECTOR_STORE.docstore._dict.values())
-        kept = []
-        removed = 0
-
-        for d in docs:
-            if d.metadata.get("file_id") == file_id:
-                removed += 1
-            else:
-                kept.append(d)
-
-        if removed:
-            VECTOR_STORE = FAISS.from_documents(kept, EMBEDDINGS)
-            save_vector_store()
-            deleted = True
-            logger.info(
-                "[RAG] FAISS vectors deleted | file=%s chunks=%d",
-                file_id,
-                removed,
-            )
+    shard = SHARDS.get(user_id)
+    removed = shard.delete_file(file_id)
+
+    if removed:
+        shard.save()
+        deleted = True
+        logger.info(
+            "[RAG] FAISS vectors deleted | file=%s chunks=%d",
+            file_id,
+            removed,
+        )
 
     return deleted
 
@@ -292,55 +553,374 @@ def _is_question_extraction(q: str) -> bool:
         )
     )
 
+# ==================================================
+# RETRIEVAL (DENSE + BM25)
+# ==================================================
+
+def _min_max(values: np.ndarray) -> np.ndarray:
+    if not len(values):
+        return values
+    lo, hi = float(values.min()), float(values.max())
+    if hi - lo < 1e-9:
+        return np.ones_like(values)
+    return (values - lo) / (hi - lo)
+
+
+def retrieve_scored(
+    question: str,
+    *,
+    k: int = TOP_K,
+    file_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+) -> List[Tuple[int, Document, float]]:
+    """
+    Top-k ``(vector_id, chunk, relevance)`` for ``question``, best first.
+
+    With a file_id, dense candidates and the document's BM25 candidates
+    are scored on both signals, min-max normalised and fused with
+    HYBRID_ALPHA. Without one (or with no keyword hit) this is plain
+    dense search over the user's shard.
+
+    ``nprobe`` / ``ef_search`` tune IVF / HNSW shards for this query.
+    """
+    return _retrieve_scope(
+        SHARDS.get(user_id),
+        question,
+        np.asarray(CACHED_EMBEDDINGS.embed_query(question), dtype=np.float32),
+        k=k,
+        file_id=file_id,
+        nprobe=nprobe,
+        ef_search=ef_search,
+    )
+
+
+def _retrieve_scope(
+    shard,
+    question: str,
+    vector: np.ndarray,
+    *,
+    k: int,
+    file_id: Optional[str],
+    nprobe: Optional[int],
+    ef_search: Optional[int],
+) -> List[Tuple[int, Document, float]]:
+    sparse_index = SPARSE.get(file_id) if file_id else None
+    sparse = sparse_index.search(question, HYBRID_FETCH_K) if sparse_index else []
+
+    dense = shard.search_vector(
+        vector,
+        HYBRID_FETCH_K if sparse else k,
+        file_id,
+        nprobe=nprobe,
+        ef_search=ef_search,
+    )
+
+    if not sparse:
+        hits = [(vid, shard.document(vid), 1.0 / (1.0 + dist)) for vid, dist in dense[:k]]
+        return [(vid, d, score) for vid, d, score in hits if d is not None]
+
+    sparse_scores = dict(sparse)
+    dense_dist = dict(dense)
+
+    candidates: Dict[int, Document] = {}
+    for vid in [*dense_dist, *sparse_scores]:
+        doc = shard.document(vid)
+        if doc is not None and (not file_id or doc.metadata.get("file_id") == file_id):
+            candidates[vid] = doc
+
+    if not candidates:
+        return []
+
+    ids = list(candidates)
+    missing = [vid for vid in ids if vid not in dense_dist]
+    dense_dist.update(zip(missing, shard.distances(vector, missing).tolist()))
+
+    dense_sim = _min_max(np.asarray([1.0 / (1.0 + dense_dist[v]) for v in ids], dtype=np.float32))
+    bm25 = _min_max(np.asarray([sparse_scores.get(v, 0.0) for v in ids], dtype=np.float32))
+    fused = HYBRID_ALPHA * dense_sim + (1.0 - HYBRID_ALPHA) * bm25
+
+    order = np.argsort(-fused)[:k]
+    return [(ids[i], candidates[ids[i]], float(fused[i])) for i in order]
+
+
+def retrieve_multi(
+    question: str,
+    file_ids: Sequence[str],
+    *,
+    k: int = TOP_K,
+    user_id: Optional[str] = None,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+) -> List[Tuple[int, Document, float]]:
+    """
+    Top-k ``(vector_id, chunk, relevance)`` across several documents.
+
+    Every file is retrieved as its own scope (hybrid, as in
+    ``retrieve_scored``) on a thread pool, so latency follows the slowest
+    file rather than the sum. Scores are min-max normalised per file,
+    then merged with a quota of ceil(k / files) chunks per file; slots a
+    file cannot fill go to the best remaining chunks of the others.
+    """
+    scopes = list(dict.fromkeys(file_ids))
+    if len(scopes) <= 1:
+        return retrieve_scored(
+            question,
+            k=k,
+            file_id=scopes[0] if scopes else None,
+            user_id=user_id,
+            nprobe=nprobe,
+            ef_search=ef_search,
+        )
+
+    shard = SHARDS.get(user_id)
+    vector = np.asarray(CACHED_EMBEDDINGS.embed_query(question), dtype=np.float32)
+
+    def search(file_id: str) -> List[Tuple[int, Document, float]]:
+        return _retrieve_scope(
+            shard, question, vector, k=k, file_id=file_id, nprobe=nprobe, ef_search=ef_search
+        )
+
+    merged: List[Tuple[int, Document, float]] = []
+    for hits in _SCOPE_POOL.map(search, scopes):
+        scores = _min_max(np.asarray([score for _, _, score in hits], dtype=np.float32))
+        merged.extend((vid, doc, float(score)) for (vid, doc, _), score in zip(hits, scores))
+    merged.sort(key=lambda hit: -hit[2])
+
+    quota = -(-k // len(scopes))
+    picked: List[Tuple[int, Document, float]] = []
+    spare: List[Tuple[int, Document, float]] = []
+    taken: Dict[str, int] = {}
+    for hit in merged:
+        fid = hit[1].metadata.get("file_id")
+        if len(picked) < k and taken.get(fid, 0) < quota:
+            picked.append(hit)
+            taken[fid] = taken.get(fid, 0) + 1
+        else:
+            spare.append(hit)
+    picked.extend(spare[:k - len(picked)])
+    picked.sort(key=lambda hit: -hit[2])
+
+    logger.info(
+        "[RAG] Multi-document retrieval | files=%d candidates=%d picked=%d",
+        len(scopes),
+        len(merged),
+        len(picked),
+    )
+    return picked
+
+
+def retrieve(
+    question: str,
+    *,
+    k: int = TOP_K,
+    file_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+) -> List[Document]:
+    """Top-k chunks for ``question`` (see ``retrieve_scored``)."""
+    hits = retrieve_scored(
+        question,
+        k=k,
+        file_id=file_id,
+        user_id=user_id,
+        nprobe=nprobe,
+        ef_search=ef_search,
+    )
+    return [doc for _, doc, _ in hits]
+
 # ==================================================
 # ANSWERING
 # ==================================================
 
-def answer(question: str, file_id: Optional[str] = None) -> str:
+def _stream_full_document(file_id: str) -> Iterator[str]:
+    """Raw text page by page, reading FULLDOC_STREAM_PAGES at a time."""
+    offset = 0
+    while True:
+        pages = load_raw_text(file_id, offset, FULLDOC_STREAM_PAGES)
+        if not pages:
+            break
+        for p in pages:
+            sep = "\n\n" if offset else ""
+            yield f"{sep}Page {p['page']}:\n{p['text']}"
+            offset += 1
+
+    if offset == 0:
+        yield "No extracted text found for this document."
+
+
+def _build_context(
+    question: str,
+    hits: List[Tuple[int, Document, float]],
+    user_id: Optional[str],
+    labels: Optional[Dict[str, str]] = None,
+) -> str:
+    """
+    Pack retrieved chunks into CHAT_MODEL's token budget (MMR + merging),
+    then optionally keep only the sentences closest to the question.
+
+    ``labels`` (file_id -> "[Document i]") marks each document's part of
+    a multi-document context.
+    """
+    ids = [vid for vid, _, _ in hits]
+    try:
+        vectors = SHARDS.get(user_id).vectors(ids)
+    except (IndexError, KeyError, RuntimeError):
+        # A chunk was deleted since retrieval: skip the diversity step
+        vectors = None
+
+    context, _ = pack_context(
+        [doc for _, doc, _ in hits],
+        [score for _, _, score in hits],
+        vectors,
+        budget=context_budget(CHAT_MODEL, question),
+        model=CHAT_MODEL,
+        labels=labels,
+    )
+
+    if CONTEXT_COMPRESSION and context:
+        context = compress_context(
+            context,
+            np.asarray(CACHED_EMBEDDINGS.embed_query(question), dtype=np.float32),
+            _embed_sentences,
+            model=CHAT_MODEL,
+            pinned=list((labels or {}).values()),
+        )
+    return context
+
+
+def resolve_scope(
+    file_id: Optional[str] = None,
+    file_ids: Optional[Sequence[str]] = None,
+    collection: Optional[str] = None,
+    user_id: Optional[str] = None,
+) -> List[str]:
+    """file_ids a question covers: ``file_id``, ``file_ids`` and the collection's files, deduplicated."""
+    scope: List[str] = [file_id] if file_id else []
+    scope.extend(file_ids or ())
+    if collection:
+        scope.extend(COLLECTIONS.get(shard_key(user_id), collection))
+    return list(dict.fromkeys(scope))
+
+
+def answer_stream(
+    question: str,
+    file_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    *,
+    file_ids: Optional[Sequence[str]] = None,
+    collection: Optional[str] = None,
+) -> Iterator[str]:
+    """
+    Answer ``question`` as a stream of text pieces.
+
+    The question covers ``file_id``, ``file_ids`` and / or the named
+    ``collection``; with several documents they are retrieved in
+    parallel and answered from one labelled context.
+
+    Grounded answers are forwarded token by token as the LLM produces
+    them; full-document requests yield one page at a time. An answer is
+    only cached once it has streamed completely.
+    """
     question = question.strip()
     if not question:
-        return "Please ask a valid question."
+        yield "Please ask a valid question."
+        return
+
+    scope = resolve_scope(file_id, file_ids, collection, user_id)
+    if collection and not scope:
+        yield f"The collection '{collection}' has no documents."
+        return
 
     # -------- FULL DOCUMENT MODE --------
     if _is_full_document_request(question):
-        if not file_id:
-            return "No document attached to this chat."
+        if not scope:
+            yield "No document attached to this chat."
+            return
 
-        pages = load_raw_text(file_id)
-        if not pages:
-            return "No extracted text found for this document."
+        if len(scope) == 1:
+            yield from _stream_full_document(scope[0])
+            return
 
-        return "\n\n".join(
-            f"Page {p['page']}:\n{p['text']}"
-            for p in pages
-        )
+        for i, fid in enumerate(scope, start=1):
+            sep = "\n\n" if i > 1 else ""
+            yield f"{sep}Document {i}:\n\n"
+            yield from _stream_full_document(fid)
+        return
 
     # -------- DOCUMENT Q&A --------
-    if VECTOR_STORE is not None:
-        docs = VECTOR_STORE.similarity_search(
-            question,
-            k=TOP_K,
-            filter={"file_id": file_id} if file_id else None,
+    cache_key = ANSWERS.key(shard_key(user_id), scope, question) if scope else None
+    if cache_key is not None:
+        cached = ANSWERS.get(cache_key)
+        if cached is not None:
+            logger.info("[RAG] Answer cache hit | files=%s", ",".join(scope))
+            yield cached
+            return
+
+    hits = retrieve_multi(question, scope, k=CONTEXT_CANDIDATES, user_id=user_id)
+    if not hits:
+        # -------- NO DOCUMENT ANSWER --------
+        yield "The answer is not present in the uploaded document."
+        return
+
+    labels = None
+    instructions = ""
+    if len(scope) > 1:
+        labels = {fid: f"[Document {i}]" for i, fid in enumerate(scope, start=1)}
+        instructions = (
+            f"The context comes from {len(scope)} documents; each document's "
+            "part starts with its label, e.g. [Document 1].\n"
+            "Say which document each point comes from.\n"
         )
-        if docs:
-            context = "\n\n".join(d.page_content for d in docs)[:MAX_CONTEXT_CHARS]
-            system_prompt = (
-                "You are a document-grounded assistant.\n"
-                "Answer strictly from the document context.\n"
-                "If the answer is not present, say so.\n\n"
-                f"{context}"
-            )
-            return _call_llm(system_prompt, question)
 
-    # -------- NO DOCUMENT ANSWER --------
-    return "The answer is not present in the uploaded document."
+    context = _build_context(question, hits, user_id, labels)
+    system_prompt = (
+        "You are a document-grounded assistant.\n"
+        "Answer strictly from the document context.\n"
+        "If the answer is not present, say so.\n"
+        f"{instructions}\n"
+        f"{context}"
+    )
+
+    parts: List[str] = []
+    for token in _call_llm_stream(system_prompt, question):
+        parts.append(token)
+        yield token
+
+    if cache_key is not None:
+        ANSWERS.put(cache_key, "".join(parts))
+
+
+def answer(
+    question: str,
+    file_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    *,
+    file_ids: Optional[Sequence[str]] = None,
+    collection: Optional[str] = None,
+) -> str:
+    return "".join(
+        answer_stream(
+            question,
+            file_id=file_id,
+            user_id=user_id,
+            file_ids=file_ids,
+            collection=collection,
+        )
+    )
 
 
 # ==================================================
 # LLM CALL (SINGLE PLACE)
 # ==================================================
 
-def _call_llm(system_prompt: str, user_prompt: str) -> str:
+# Keep-alive connection to OpenRouter: skips the TLS handshake per question
+_HTTP = requests.Session()
+
+
+def _call_llm_stream(system_prompt: str, user_prompt: str) -> Iterator[str]:
     payload = {
         "model": CHAT_MODEL,
         "messages": [
@@ -348,6 +928,7 @@ def _call_llm(system_prompt: str, user_prompt: str) -> str:
             {"role": "user", "content": user_prompt},
         ],
         "temperature": 0.3,
+        "stream": True,
     }
 
     headers = {
@@ -355,28 +936,73 @@ def _call_llm(system_prompt: str, user_prompt: str) -> str:
         "Content-Type": "application/json",
     }
 
-    response = requests.post(
+    with _HTTP.post(
         OPENROUTER_URL,
         headers=headers,
         json=payload,
+        stream=True,
         timeout=60,
-    )
-    response.raise_for_status()
+    ) as response:
+        response.raise_for_status()
+
+        for line in response.iter_lines(decode_unicode=True):
+            # SSE: "data: {...}"; comments / keep-alives are skipped
+            if not line or not line.startswith("data:"):
+                continue
 
-    return response.json()["choices"][0]["message"]["content"]
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+
+            try:
+                content = json.loads(data)["choices"][0].get("delta", {}).get("content")
+            except (ValueError, KeyError, IndexError):
+                continue
+
+            if content:
+                yield content
 
 # ==================================================
 # API HELPERS
 # ==================================================
 
-def get_raw_text(file_id: str) -> List[Dict]:
-    return load_raw_text(file_id)
+def get_raw_text(file_id: str, offset: int = 0, limit: Optional[int] = None) -> List[Dict]:
+    return load_raw_text(file_id, offset, limit)
 
 
-def get_chunks_preview(limit: int = 5) -> List[str]:
-    if VECTOR_STORE is None:
-        return []
-    return [d.page_content for d in list(VECTOR_STORE.docstore._dict.values())[:limit]]
+def get_raw_text_page_count(file_id: str) -> int:
+    return raw_text_page_count(file_id)
+
+
+def compact_index(user_id: Optional[str] = None) -> int:
+    """Merge a shard's segments into its base now (blocking)."""
+    return SHARDS.get(user_id).merge()
+
+
+def get_chunks_preview(limit: int = 5, user_id: Optional[str] = None) -> List[str]:
+    return SHARDS.get(user_id).preview(limit)
+
+
+def set_collection(name: str, file_ids: Sequence[str], user_id: Optional[str] = None) -> List[str]:
+    """Create or replace the named collection; returns its file_ids."""
+    return COLLECTIONS.put(shard_key(user_id), name, file_ids)
+
+
+def get_collection(name: str, user_id: Optional[str] = None) -> List[str]:
+    return COLLECTIONS.get(shard_key(user_id), name)
+
+
+def list_collections(user_id: Optional[str] = None) -> List[str]:
+    return COLLECTIONS.names(shard_key(user_id))
+
+
+def delete_collection(name: str, user_id: Optional[str] = None) -> bool:
+    return COLLECTIONS.delete(shard_key(user_id), name)
+
+
+def remove_from_collections(file_id: str, user_id: Optional[str] = None) -> None:
+    """Drop a deleted file from the user's collections (not done on re-ingest)."""
+    COLLECTIONS.remove_file(shard_key(user_id), file_id)
 
 
 def answer_question(question: str) -> str:
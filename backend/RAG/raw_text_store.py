@@ -0,0 +1,130 @@
+"""
+Paged raw-text store
+--------------------
+
+Extracted page text is stored one file per document in a compact binary
+layout that can be read page-by-page through ``mmap``:
+
+    header   MAGIC (8 bytes) | flags u32 | page_count u32
+    offsets  (page_count + 1) x u64, relative to the data section
+    data     page blobs (UTF-8, zlib-compressed when FLAG_ZLIB is set)
+
+Reading pages [offset, offset + limit) touches the header, two offsets per
+page and the requested blobs only, so previewing page 1 costs the same for
+a 5-page and a 5,000-page document.
+
+``PageWriter`` appends pages one at a time (offsets are patched in at the
+end), so ingestion never needs the whole document's text in memory.
+"""
+
+from __future__ import annotations
+
+import os
+import mmap
+import zlib
+import struct
+from typing import Dict, List, Optional
+
+MAGIC = b"RAGPAGE1"
+FLAG_ZLIB = 0x1
+
+_HEADER = struct.Struct("<8sII")
+_OFFSET = struct.Struct("<Q")
+
+
+class PageWriter:
+    """
+    Streams pages to ``path`` (via a temp file) for a known page count.
+
+    ``commit()`` patches the offset table and renames into place;
+    ``abort()`` (or leaving the ``with`` block on an exception) discards
+    the temp file.
+    """
+
+    def __init__(self, path: str, count: int, *, compress: bool = True) -> None:
+        self.path = path
+        self.count = count
+        self.compress = compress
+        self.offsets = [0]
+
+        self._tmp = path + ".tmp"
+        self._f = open(self._tmp, "wb")
+        self._f.write(_HEADER.pack(MAGIC, FLAG_ZLIB if compress else 0, count))
+        self._f.write(b"\0" * (_OFFSET.size * (count + 1)))
+
+    def add(self, text: str) -> None:
+        if len(self.offsets) > self.count:
+            raise ValueError("More pages written than declared")
+        blob = text.encode("utf-8")
+        if self.compress:
+            blob = zlib.compress(blob, 6)
+        self._f.write(blob)
+        self.offsets.append(self.offsets[-1] + len(blob))
+
+    def commit(self) -> None:
+        # Pages never written (e.g. extraction budget ran out) are empty
+        while len(self.offsets) <= self.count:
+            self.add("")
+
+        self._f.seek(_HEADER.size)
+        self._f.write(struct.pack(f"<{len(self.offsets)}Q", *self.offsets))
+        self._f.close()
+        os.replace(self._tmp, self.path)
+
+    def abort(self) -> None:
+        if not self._f.closed:
+            self._f.close()
+        if os.path.exists(self._tmp):
+            os.remove(self._tmp)
+
+    def __enter__(self) -> "PageWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None or not self._f.closed:
+            self.abort()
+
+
+def write_pages(path: str, pages: List[str], *, compress: bool = True) -> None:
+    """Write all pages atomically (temp file + rename)."""
+    with PageWriter(path, len(pages), compress=compress) as writer:
+        for text in pages:
+            writer.add(text)
+        writer.commit()
+
+
+def page_count(path: str) -> int:
+    with open(path, "rb") as f:
+        magic, _, count = _HEADER.unpack(f.read(_HEADER.size))
+    if magic != MAGIC:
+        raise ValueError(f"Not a paged raw-text file: {path}")
+    return count
+
+
+def read_pages(path: str, offset: int = 0, limit: Optional[int] = None) -> List[Dict]:
+    """
+    Return ``[{"page": n, "text": ...}]`` for pages
+    ``offset .. offset + limit - 1`` (0-based offset, 1-based page numbers).
+    """
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, flags, count = _HEADER.unpack_from(mm, 0)
+            if magic != MAGIC:
+                raise ValueError(f"Not a paged raw-text file: {path}")
+
+            start = max(offset, 0)
+            stop = count if limit is None else min(count, start + max(limit, 0))
+
+            table = _HEADER.size
+            data = table + _OFFSET.size * (count + 1)
+
+            pages: List[Dict] = []
+            for i in range(start, stop):
+                (lo,) = _OFFSET.unpack_from(mm, table + _OFFSET.size * i)
+                (hi,) = _OFFSET.unpack_from(mm, table + _OFFSET.size * (i + 1))
+                blob = mm[data + lo:data + hi]
+                if flags & FLAG_ZLIB:
+                    blob = zlib.decompress(blob)
+                pages.append({"page": i + 1, "text": blob.decode("utf-8")})
+
+            return pages
@@ -0,0 +1,207 @@
+"""
+Per-document BM25 index
+-----------------------
+
+Dense retrieval misses exact identifiers, error codes and rare terms.
+At ingest time every document also gets a small inverted index over the
+same chunks (keyed by the chunks' vector IDs), persisted as
+``rag_data/sparse/<file_id>.pkl``.
+
+Postings are numpy arrays, so scoring a query is a handful of vectorised
+operations over the matching chunks only (well under a millisecond for
+typical documents). Loaded indexes are kept in a small LRU.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import pickle
+import logging
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("RAG")
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Identifiers like "ERR-1045", "v2.3.1", "os.path" stay whole; their
+# parts are indexed too so "1045" alone still matches.
+_TOKEN = re.compile(r"[a-z0-9_]+(?:[.\-:/][a-z0-9_]+)*")
+_SPLIT = re.compile(r"[.\-:/]")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how i in is it its of on or "
+    "that the this to was were what when where which who why will with you "
+    "your do does did can could should would".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    tokens: List[str] = []
+    for tok in _TOKEN.findall(text.lower()):
+        if tok in STOPWORDS:
+            continue
+        tokens.append(tok)
+        parts = _SPLIT.split(tok)
+        if len(parts) > 1:
+            tokens.extend(p for p in parts if p and p not in STOPWORDS)
+    return tokens
+
+
+class BM25Index:
+    """
+    Inverted index over one document's chunks.
+
+    postings[term] = (chunk positions int32[], term frequencies float32[])
+    """
+
+    def __init__(
+        self,
+        vector_ids: np.ndarray,
+        doc_len: np.ndarray,
+        postings: Dict[str, Tuple[np.ndarray, np.ndarray]],
+    ) -> None:
+        self.vector_ids = vector_ids
+        self.doc_len = doc_len
+        self.postings = postings
+        self.avgdl = float(doc_len.mean()) if len(doc_len) else 0.0
+
+    @classmethod
+    def build(cls, vector_ids: List[int], texts: List[str]) -> "BM25Index":
+        builder = BM25Builder()
+        builder.add(vector_ids, texts)
+        return builder.build()
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Top-k ``(vector_id, bm25_score)``, best first."""
+        n = len(self.vector_ids)
+        if not n:
+            return []
+
+        scores = np.zeros(n, dtype=np.float32)
+        matched = False
+
+        for term in set(tokenize(query)):
+            entry = self.postings.get(term)
+            if entry is None:
+                continue
+            matched = True
+            pos, tf = entry
+            idf = np.log1p((n - len(pos) + 0.5) / (len(pos) + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len[pos] / (self.avgdl or 1.0))
+            scores[pos] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        if not matched:
+            return []
+
+        k = min(k, n)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (int(self.vector_ids[i]), float(scores[i]))
+            for i in top
+            if scores[i] > 0
+        ]
+
+
+class BM25Builder:
+    """
+    Builds a ``BM25Index`` batch by batch while a document is ingested;
+    only postings are kept, never the chunk texts.
+    """
+
+    def __init__(self) -> None:
+        self._vector_ids: List[int] = []
+        self._lengths: List[int] = []
+        self._raw: Dict[str, Tuple[List[int], List[int]]] = {}
+
+    def add(self, vector_ids: List[int], texts: List[str]) -> None:
+        for vid, text in zip(vector_ids, texts):
+            pos = len(self._vector_ids)
+            tokens = tokenize(text)
+            self._vector_ids.append(vid)
+            self._lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                entry = self._raw.setdefault(term, ([], []))
+                entry[0].append(pos)
+                entry[1].append(tf)
+
+    def build(self) -> BM25Index:
+        postings = {
+            term: (np.asarray(p, dtype=np.int32), np.asarray(f, dtype=np.float32))
+            for term, (p, f) in self._raw.items()
+        }
+        return BM25Index(
+            np.asarray(self._vector_ids, dtype=np.int64),
+            np.asarray(self._lengths, dtype=np.float32),
+            postings,
+        )
+
+
+class SparseIndexStore:
+    """
+    Persists one ``BM25Index`` per file_id; keeps recent ones loaded.
+    """
+
+    def __init__(self, directory: str, cache_size: int = 64) -> None:
+        self.directory = directory
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, BM25Index]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, file_id: str) -> str:
+        return os.path.join(self.directory, f"{file_id}.pkl")
+
+    def _remember(self, file_id: str, index: BM25Index) -> None:
+        with self._lock:
+            self._cache[file_id] = index
+            self._cache.move_to_end(file_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def save(self, file_id: str, index: BM25Index) -> None:
+        tmp = self._path(file_id) + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump((index.vector_ids, index.doc_len, index.postings), f)
+        os.replace(tmp, self._path(file_id))
+        self._remember(file_id, index)
+
+        logger.info(
+            "[RAG] BM25 index saved | file=%s chunks=%d terms=%d",
+            file_id,
+            len(index.vector_ids),
+            len(index.postings),
+        )
+
+    def get(self, file_id: str) -> Optional[BM25Index]:
+        with self._lock:
+            index = self._cache.get(file_id)
+            if index is not None:
+                self._cache.move_to_end(file_id)
+                return index
+
+        path = self._path(file_id)
+        if not os.path.exists(path):
+            return None
+
+        with open(path, "rb") as f:
+            index = BM25Index(*pickle.load(f))
+        self._remember(file_id, index)
+        return index
+
+    def delete(self, file_id: str) -> bool:
+        with self._lock:
+            self._cache.pop(file_id, None)
+
+        path = self._path(file_id)
+        if os.path.exists(path):
+            os.remove(path)
+            return True
+        return False
@@ -0,0 +1,1337 @@
+"""
+Per-user FAISS shards
+---------------------
+
+Every user (or collection) owns an independent FAISS index stored under
+``rag_data/faiss/<shard>/``. Queries only touch the caller's shard and
+ingestion only rewrites the shard it changed, so per-tenant cost no longer
+grows with the total number of chunks across all users.
+
+Vectors are stored in an ID-mapped index (``IndexIDMap2``) so a document
+can be deleted by its vector IDs without re-embedding anything:
+
+- delete  -> drop chunk rows, tombstone the vector IDs     (O(deleted))
+- search  -> tombstoned IDs are excluded inside FAISS
+- per-file search -> only that file's IDs are passed to FAISS as a selector
+- merge   -> ``remove_ids`` reclaims tombstoned slots later
+
+On disk a shard is a base snapshot plus small append-only segments:
+
+    manifest.json              which files make up the shard (swapped atomically)
+    base-NNNNNN.faiss          compacted snapshot
+    seg-NNNNNN.faiss           vectors added by one save
+    del-NNNNNN.npy             vector IDs deleted by one save
+    chunks.sqlite3             chunk text + metadata by vector ID (see chunk_store)
+
+A save writes only what changed since the previous save, so upload latency
+no longer grows with the corpus. Chunk rows are committed to SQLite when the
+chunks are added; a row whose vectors never reached a segment (crash before
+the save) is dropped on the next load.
+
+A large document is added in batches while it is still being embedded:
+``stage()`` stores a batch but keeps it hidden from searches, ``publish()``
+makes the whole document visible in one step and ``discard()`` drops it if
+the ingest fails. The manifest lists staged vector IDs, so a crash in
+between never leaves half a document searchable. Shards written with pickled
+docstores (``.pkl`` next to each base / segment) are imported into SQLite
+once on load.
+
+Index type follows the shard's size (``RAG_INDEX_TYPE=auto``): exact flat
+search for small shards, HNSW past ``HNSW_MIN_VECTORS`` and IVF past
+``IVF_MIN_VECTORS``. Crossing a threshold schedules a background merge that
+trains the new index on a copy and swaps it in; searches keep using the old
+index meanwhile. ``nprobe`` / ``efSearch`` can be set per query.
+
+With ``RAG_VECTOR_CODEC`` set to fp16 / sq8 / pq, shards past
+``QUANTIZE_MIN_VECTORS`` keep only compressed codes in the index (2x / 4x /
+16x smaller than float32). Full-precision copies live next to the base as
+``base-NNNNNN.ids.npy`` / ``.vec.npy``, opened with ``mmap``, and are used to
+re-rank a small candidate set exactly. Every file is written to a temp name,
+fsynced and renamed; the directory is fsynced before the manifest is renamed
+last, so a crash or power loss leaves the previous snapshot intact. A segment
+that still cannot be read at load time is quarantined (``*.corrupt``) and
+skipped rather than failing the whole shard. A background merge folds segments and deletes into a new
+base once there are enough of them.
+
+Base snapshots are opened memory-mapped and read-only (``RAG_MMAP_INDEX``;
+every index type with faiss >= 1.11, only IVF before), so worker processes
+serving the same shard share one copy in the page cache and loading a shard
+does not read the whole base into memory. A mapped base
+is never modified: vectors from segments and new uploads go to a small
+in-memory flat "delta" index that is searched alongside it and folded into
+the next base by the merge.
+
+Concurrency: searches take a shared read lock and run in parallel. Adding
+a document's chunks, deleting a file and swapping in a merged index take
+the write lock for a few in-memory operations only; segment writes, base
+writes and index training work on detached copies, so a search never waits
+on disk I/O or training and never sees a partially added document.
+
+Shards are loaded lazily on first access.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import json
+import pickle
+import shutil
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+import faiss
+import numpy as np
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from RAG.chunk_store import ChunkStore
+
+logger = logging.getLogger("RAG")
+
+DEFAULT_SHARD = "default"
+
+_SAFE_KEY = re.compile(r"[A-Za-z0-9_-][A-Za-z0-9_.-]{0,63}")
+
+INDEX_FILES = ("index.faiss", "index.pkl")
+
+MANIFEST = "manifest.json"
+CHUNKS_DB = "chunks.sqlite3"
+QUARANTINE_SUFFIX = ".corrupt"
+
+# Index type: "flat", "hnsw", "ivf" or "auto" (by live vector count)
+INDEX_TYPE = os.getenv("RAG_INDEX_TYPE", "auto").lower()
+INDEX_TYPES = ("flat", "hnsw", "ivf")
+HNSW_MIN_VECTORS = int(os.getenv("RAG_HNSW_MIN_VECTORS", "50000"))
+IVF_MIN_VECTORS = int(os.getenv("RAG_IVF_MIN_VECTORS", "1000000"))
+
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = int(os.getenv("RAG_HNSW_EF_SEARCH", "64"))
+
+IVF_NPROBE = int(os.getenv("RAG_IVF_NPROBE", "16"))
+# Training sample per inverted list / PQ centroid (faiss wants >= 39)
+IVF_TRAIN_PER_LIST = 64
+
+# Vector storage: "none" (float32), "fp16", "sq8" (int8) or "pq"
+VECTOR_CODEC = os.getenv("RAG_VECTOR_CODEC", "none").lower()
+VECTOR_CODECS = ("none", "fp16", "sq8", "pq")
+QUANTIZE_MIN_VECTORS = int(os.getenv("RAG_QUANTIZE_MIN_VECTORS", "10000"))
+# PQ: one 8-bit code per this many dimensions (384-d -> 96 bytes)
+PQ_DIMS_PER_CODE = 4
+_SQ_TYPES = {
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "sq8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+# Quantized search: candidates re-ranked on full-precision vectors
+RERANK_FACTOR = 4
+RERANK_MIN = 32
+
+# Map base snapshots read-only instead of reading them into memory.
+# faiss >= 1.11 (IO_FLAG_MMAP_IFC) maps the codes of every index type in
+# place; older releases only map IVF inverted lists and read the rest
+# into memory as before.
+MMAP_INDEX = os.getenv("RAG_MMAP_INDEX", "1") == "1"
+_MMAP_IFC = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+_MMAP_FLAGS = (_MMAP_IFC or faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+# Merge segments into the base once there are this many ...
+MERGE_MAX_SEGMENTS = 16
+# ... or once this fraction of stored vectors is tombstoned
+COMPACT_TOMBSTONE_RATIO = 0.2
+
+
+def shard_key(user_id: Optional[str]) -> str:
+    """Resolve the shard for a user; falls back to the default tenant."""
+    return user_id or DEFAULT_SHARD
+
+
+def _shard_dirname(key: str) -> str:
+    """Filesystem-safe directory name for a shard key."""
+    if _SAFE_KEY.fullmatch(key):
+        return key
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def _id_selector(ids: Iterable[int]) -> faiss.IDSelectorBatch:
+    return faiss.IDSelectorBatch(np.fromiter(ids, dtype=np.int64))
+
+
+def _fsync_file(path: str) -> None:
+    # Read-write: Windows cannot flush a read-only handle
+    fd = os.open(path, os.O_RDWR)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_dir(directory: str) -> None:
+    """Make renames in ``directory`` durable (no-op on Windows)."""
+    if os.name == "nt":
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _atomic_write(path: str, write: Callable[[str], None]) -> None:
+    """Write via ``write(tmp_path)``, fsync, then rename over ``path``."""
+    tmp = path + ".tmp"
+    write(tmp)
+    _fsync_file(tmp)
+    os.replace(tmp, path)
+
+
+def _write_json(path: str, obj) -> None:
+    """Publish a manifest: the files it names are durable before it is."""
+    def write(tmp: str) -> None:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(obj, f)
+
+    directory = os.path.dirname(path)
+    _fsync_dir(directory)
+    _atomic_write(path, write)
+    _fsync_dir(directory)
+
+
+def _write_npy(path: str, array: np.ndarray) -> None:
+    with open(path, "wb") as f:
+        np.save(f, array)
+
+
+def _id_ranges(ids: Iterable[int]) -> List[List[int]]:
+    """Sorted IDs as ``[start, stop)`` runs (compact manifest entries)."""
+    ranges: List[List[int]] = []
+    for vid in sorted(ids):
+        if ranges and ranges[-1][1] == vid:
+            ranges[-1][1] = vid + 1
+        else:
+            ranges.append([vid, vid + 1])
+    return ranges
+
+
+def _expand_ranges(ranges: Iterable[Sequence[int]]) -> List[int]:
+    return [vid for start, stop in ranges for vid in range(start, stop)]
+
+
+def _segment_index(vectors: np.ndarray, ids: np.ndarray) -> faiss.IndexIDMap2:
+    index = faiss.IndexIDMap2(faiss.IndexFlatL2(vectors.shape[1]))
+    index.add_with_ids(vectors, ids)
+    return index
+
+
+def _can_map(kind: str) -> bool:
+    """True if this faiss build memory-maps an index of ``kind``."""
+    return MMAP_INDEX and (_MMAP_IFC is not None or kind == "ivf")
+
+
+def _open_base(path: str) -> Tuple[faiss.Index, bool]:
+    """
+    Read a base snapshot, memory-mapped where possible. The flag is True
+    only if the index really is mapped (and so must not be modified).
+    """
+    if MMAP_INDEX:
+        try:
+            index = faiss.read_index(path, _MMAP_FLAGS)
+        except RuntimeError:
+            logger.warning("[RAG] Index cannot be memory-mapped, reading it | %s", path)
+        else:
+            if isinstance(index, faiss.IndexIDMap2):
+                return index, _can_map(index_kind(index))
+            return index, _MMAP_IFC is not None
+    return faiss.read_index(path), False
+
+
+def index_kind(index: Optional[faiss.IndexIDMap2]) -> str:
+    """"flat", "hnsw" or "ivf" for an ID-mapped index."""
+    if index is None:
+        return "flat"
+    inner = faiss.downcast_index(index.index)
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(inner, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+
+def index_codec(index: Optional[faiss.IndexIDMap2]) -> str:
+    """Vector codec of an ID-mapped index (see VECTOR_CODECS)."""
+    if index is None:
+        return "none"
+    inner = faiss.downcast_index(index.index)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner = faiss.downcast_index(inner.storage)
+    if isinstance(inner, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return "pq"
+    if isinstance(inner, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return "fp16" if inner.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    return "none"
+
+
+def choose_index_kind(n_vectors: int, current: str = "flat") -> str:
+    """
+    Index type for a shard of ``n_vectors`` live vectors.
+
+    Thresholds only fall back at half their value so a shard hovering
+    around one is not rebuilt on every merge.
+    """
+    if INDEX_TYPE in INDEX_TYPES:
+        return INDEX_TYPE
+
+    def over(threshold: int, kind: str) -> bool:
+        return n_vectors >= (threshold // 2 if current == kind else threshold)
+
+    if over(IVF_MIN_VECTORS, "ivf"):
+        return "ivf"
+    if over(HNSW_MIN_VECTORS, "hnsw") or (current == "ivf" and n_vectors >= HNSW_MIN_VECTORS // 2):
+        return "hnsw"
+    return "flat"
+
+
+def choose_codec(n_vectors: int, current: str = "none") -> str:
+    """Configured codec once the shard is big enough to be worth it."""
+    if VECTOR_CODEC not in VECTOR_CODECS or VECTOR_CODEC == "none":
+        return "none"
+    threshold = QUANTIZE_MIN_VECTORS // 2 if current == VECTOR_CODEC else QUANTIZE_MIN_VECTORS
+    return VECTOR_CODEC if n_vectors >= threshold else "none"
+
+
+def _pq_codes(d: int) -> int:
+    m = max(d // PQ_DIMS_PER_CODE, 1)
+    while d % m:
+        m -= 1
+    return m
+
+
+def build_index(
+    kind: str,
+    vectors: np.ndarray,
+    ids: np.ndarray,
+    codec: str = "none",
+) -> faiss.IndexIDMap2:
+    """Build (and train, if needed) an ID-mapped index over ``vectors``."""
+    n, d = vectors.shape
+    nlist = 0
+
+    if kind == "hnsw":
+        if codec in _SQ_TYPES:
+            inner = faiss.IndexHNSWSQ(d, _SQ_TYPES[codec], HNSW_M)
+        elif codec == "pq":
+            inner = faiss.IndexHNSWPQ(d, _pq_codes(d), HNSW_M)
+        else:
+            inner = faiss.IndexHNSWFlat(d, HNSW_M)
+        inner.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        inner.hnsw.efSearch = HNSW_EF_SEARCH
+    elif kind == "ivf":
+        nlist = int(min(max(4 * np.sqrt(n), 64), 65536, n // 39 or 1))
+        quantizer = faiss.IndexFlatL2(d)
+        if codec in _SQ_TYPES:
+            inner = faiss.IndexIVFScalarQuantizer(quantizer, d, nlist, _SQ_TYPES[codec])
+        elif codec == "pq":
+            inner = faiss.IndexIVFPQ(quantizer, d, nlist, _pq_codes(d), 8)
+        else:
+            inner = faiss.IndexIVFFlat(quantizer, d, nlist)
+        inner.nprobe = IVF_NPROBE
+    else:
+        if codec in _SQ_TYPES:
+            inner = faiss.IndexScalarQuantizer(d, _SQ_TYPES[codec])
+        elif codec == "pq":
+            inner = faiss.IndexPQ(d, _pq_codes(d), 8)
+        else:
+            inner = faiss.IndexFlatL2(d)
+
+    if not inner.is_trained:
+        sample_size = min(n, max(nlist, 256) * IVF_TRAIN_PER_LIST)
+        sample = vectors[np.random.default_rng(0).choice(n, sample_size, replace=False)]
+        inner.train(sample)
+
+    if kind == "ivf":
+        # reconstruct() by ID is needed for merges and per-file search
+        inner.make_direct_map()
+
+    index = faiss.IndexIDMap2(inner)
+    if len(ids):
+        index.add_with_ids(vectors, ids)
+    return index
+
+
+class ExactVectorStore:
+    """
+    Full-precision vectors behind a quantized index, by vector ID.
+
+    The base part is a sorted ``ids.npy`` / ``vec.npy`` pair opened with
+    ``mmap`` (pages are read on demand); vectors added since the last
+    merge are kept in memory until the next one.
+    """
+
+    def __init__(self, ids: Optional[np.ndarray] = None, vectors: Optional[np.ndarray] = None) -> None:
+        self.base_ids = ids if ids is not None else np.zeros(0, dtype=np.int64)
+        self.base_vectors = vectors
+        self.fresh: Dict[int, np.ndarray] = {}
+
+    @classmethod
+    def open(cls, prefix: str) -> "ExactVectorStore":
+        return cls(
+            np.load(f"{prefix}.ids.npy", mmap_mode="r"),
+            np.load(f"{prefix}.vec.npy", mmap_mode="r"),
+        )
+
+    @staticmethod
+    def write(prefix: str, ids: np.ndarray, vectors: np.ndarray) -> None:
+        _atomic_write(f"{prefix}.ids.npy", lambda tmp: _write_npy(tmp, ids))
+        _atomic_write(f"{prefix}.vec.npy", lambda tmp: _write_npy(tmp, vectors))
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        for vid, vec in zip(ids.tolist(), vectors):
+            self.fresh[vid] = np.array(vec, dtype=np.float32)
+
+    def discard(self, ids: List[int]) -> None:
+        for vid in ids:
+            self.fresh.pop(vid, None)
+
+    def get(self, ids: List[int]) -> np.ndarray:
+        rows = []
+        for vid in ids:
+            vec = self.fresh.get(vid)
+            if vec is None:
+                vec = self.base_vectors[np.searchsorted(self.base_ids, vid)]
+            rows.append(vec)
+        return np.vstack(rows).astype(np.float32, copy=False)
+
+    def select(self, live: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """``(ids, vectors)`` for the IDs in ``live``."""
+        mask = np.isin(self.base_ids, live)
+        ids = [np.asarray(self.base_ids[mask])]
+        vectors = [np.asarray(self.base_vectors[mask])] if self.base_vectors is not None else []
+
+        live_set = set(live.tolist())
+        fresh = [vid for vid in self.fresh if vid in live_set]
+        if fresh:
+            ids.append(np.asarray(fresh, dtype=np.int64))
+            vectors.append(np.vstack([self.fresh[vid] for vid in fresh]))
+
+        return np.concatenate(ids), np.vstack(vectors)
+
+
+def _search_params(
+    index: faiss.IndexIDMap2,
+    selector,
+    nprobe: Optional[int],
+    ef_search: Optional[int],
+):
+    kind = index_kind(index)
+    if kind == "ivf":
+        return faiss.SearchParametersIVF(sel=selector, nprobe=nprobe or IVF_NPROBE)
+    if kind == "hnsw":
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search or HNSW_EF_SEARCH)
+    return faiss.SearchParameters(sel=selector) if selector is not None else None
+
+
+def _supports_selector(index: faiss.IndexIDMap2) -> bool:
+    """Flat PQ (``IndexPQ``) rejects ID selectors."""
+    return not (index_kind(index) == "flat" and index_codec(index) == "pq")
+
+
+class ReadWriteLock:
+    """
+    Many concurrent readers or one writer. Waiting writers block new
+    readers, so a stream of queries cannot starve ingestion.
+    Not reentrant.
+    """
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+# ==================================================
+# SINGLE SHARD
+# ==================================================
+
+class VectorShard:
+    """
+    One ID-mapped FAISS index + chunk store belonging to a single user.
+    """
+
+    def __init__(self, key: str, directory: str, embeddings: Embeddings) -> None:
+        self.key = key
+        self.directory = directory
+        self.embeddings = embeddings
+
+        self.index: Optional[faiss.IndexIDMap2] = None
+        # True when ``index`` is a memory-mapped base, which must not be
+        # modified; vectors added on top of it go to ``delta``
+        self.mapped = False
+        self.delta: Optional[faiss.IndexIDMap2] = None
+        self._delta_ids: Set[int] = set()
+        # Full-precision vectors when the index stores quantized codes
+        self.exact: Optional[ExactVectorStore] = None
+        # Opened on load / first add
+        self.store: Optional[ChunkStore] = None
+        # vector IDs with a chunk row (searchable)
+        self.live: Set[int] = set()
+        # vector IDs still in the index but no longer live
+        self.tombstones: Set[int] = set()
+        # vector IDs stored but not yet published (hidden from searches)
+        self.staged: Set[int] = set()
+        self.next_id = 0
+
+        # On-disk snapshot (see module docstring)
+        self.manifest: Dict = {"gen": 0, "docstore": "sqlite", "base": None, "segments": [], "deletes": []}
+
+        # Vectors not yet written to a segment
+        self._unsaved_adds: List[Tuple[np.ndarray, np.ndarray]] = []
+        self._unsaved_deletes: List[int] = []
+
+        # Searches share the in-memory index; add / delete / swap hold it
+        # exclusively and only briefly. Slow work (disk writes, training)
+        # happens on copies outside it.
+        self._rw = ReadWriteLock()
+        # Serialises persistence (segment / base / manifest writes)
+        self._io_lock = threading.RLock()
+        self._merge_lock = threading.Lock()
+        self._merging = False
+        # Bumped when the shard is emptied; invalidates in-flight merges
+        self._epoch = 0
+
+    # ---------------- persistence ----------------
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _next_name(self, prefix: str) -> str:
+        self.manifest["gen"] += 1
+        return f"{prefix}-{self.manifest['gen']:06d}"
+
+    def _read_manifest(self) -> Optional[Dict]:
+        path = self._path(MANIFEST)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+
+        # Pre-segment layout: index.faiss / index.pkl is the base
+        if os.path.exists(self._path("index.faiss")):
+            return {"gen": 0, "base": "index", "segments": [], "deletes": []}
+
+        return None
+
+    def _attach_vectors(self, name: str, index: faiss.Index, mapped: bool = False) -> None:
+        """Add the vectors of a base / segment file to the live index."""
+        if self.index is None and isinstance(index, faiss.IndexIDMap2):
+            # Base snapshot (any index type) becomes the live index
+            self.index = index
+            self.mapped = mapped
+            if index_codec(index) != "none":
+                self.exact = ExactVectorStore.open(self._path(name))
+            return
+
+        if isinstance(index, faiss.IndexIDMap2):
+            ids = faiss.vector_to_array(index.id_map).astype(np.int64)
+            vectors = index.index.reconstruct_n(0, index.ntotal)
+        else:
+            # Pre-ID-map index: positions were the IDs. Copy the stored
+            # vectors over as-is (no re-embedding).
+            ids = np.arange(index.ntotal, dtype=np.int64)
+            vectors = index.reconstruct_n(0, index.ntotal)
+
+        if self.index is None:
+            self.index = faiss.IndexIDMap2(faiss.IndexFlatL2(index.d))
+        if len(ids):
+            self._store(ids, vectors)
+
+    def _store(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        """Add vectors to the live index, or to the delta over a mapped base."""
+        if self.mapped:
+            if self.delta is None:
+                self.delta = faiss.IndexIDMap2(faiss.IndexFlatL2(self.index.d))
+            self.delta.add_with_ids(vectors, ids)
+            self._delta_ids.update(ids.tolist())
+        else:
+            self.index.add_with_ids(vectors, ids)
+        if self.exact is not None:
+            self.exact.add(ids, vectors)
+
+    def _stored_ids(self) -> np.ndarray:
+        """IDs of every stored vector (live or tombstoned)."""
+        stored = [faiss.vector_to_array(self.index.id_map)]
+        if self.delta is not None:
+            stored.append(faiss.vector_to_array(self.delta.id_map))
+        return np.concatenate(stored).astype(np.int64)
+
+    def _ntotal(self) -> int:
+        return self.index.ntotal + (self.delta.ntotal if self.delta is not None else 0)
+
+    def _open_store(self) -> ChunkStore:
+        if self.store is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.store = ChunkStore(self._path(CHUNKS_DB))
+        return self.store
+
+    def _import_pickles(self, manifest: Dict) -> None:
+        """Move chunks from pickled docstores (older layout) into SQLite."""
+        store = self._open_store()
+        imported = 0
+
+        for name in filter(None, [manifest["base"], *manifest["segments"]]):
+            path = self._path(f"{name}.pkl")
+            if not os.path.exists(path):
+                continue
+            with open(path, "rb") as f:
+                docstore, mapping = pickle.load(f)
+            ids, docs = [], []
+            for vid, doc_id in mapping.items():
+                doc = docstore.search(doc_id)
+                if isinstance(doc, Document):
+                    ids.append(vid)
+                    docs.append(doc)
+            store.add(ids, docs)
+            imported += len(ids)
+
+        for name in manifest["deletes"]:
+            store.delete(np.load(self._path(f"{name}.npy")).tolist())
+
+        manifest["docstore"] = "sqlite"
+        _write_json(self._path(MANIFEST), manifest)
+
+        logger.info("[RAG] Shard docstore moved to SQLite | shard=%s chunks=%d", self.key, imported)
+
+    def load(self) -> None:
+        manifest = self._read_manifest()
+        if manifest is None:
+            return
+
+        self.manifest = manifest
+        store = self._open_store()
+        if manifest.get("docstore") != "sqlite":
+            self._import_pickles(manifest)
+
+        if manifest["base"] is not None:
+            path = self._path(f"{manifest['base']}.faiss")
+            index, mapped = _open_base(path)
+            self._attach_vectors(manifest["base"], index, mapped)
+
+        for name in list(manifest["segments"]):
+            try:
+                segment = faiss.read_index(self._path(f"{name}.faiss"))
+            except RuntimeError:
+                self._quarantine_segment(name)
+                continue
+            self._attach_vectors(name, segment)
+
+        if self.index is None:
+            return
+
+        staged = _expand_ranges(manifest.get("staged", []))
+        if staged:
+            # An ingest stopped before publishing: its chunks never went live
+            store.delete(staged)
+            logger.warning("[RAG] Unpublished chunks dropped | shard=%s chunks=%d", self.key, len(staged))
+
+        stored = self._stored_ids()
+        rows = store.ids()
+        has_vector = np.isin(rows, stored)
+        if not has_vector.all():
+            # Chunks added but never saved (the process stopped first)
+            store.delete(rows[~has_vector].tolist())
+        self.live = set(rows[has_vector].tolist())
+        self.tombstones = set(np.setdiff1d(stored, rows).tolist())
+        # IDs are never reused, even after a merge dropped the highest one
+        self.next_id = max(
+            manifest.get("next_id", 0),
+            int(stored.max()) + 1 if len(stored) else 0,
+        )
+
+        self._remove_unreferenced_files()
+
+        logger.info(
+            "[RAG] Shard loaded | shard=%s type=%s codec=%s mapped=%s vectors=%d tombstones=%d segments=%d",
+            self.key,
+            index_kind(self.index),
+            index_codec(self.index),
+            self.mapped,
+            self._ntotal(),
+            len(self.tombstones),
+            len(self.manifest["segments"]),
+        )
+
+    def _quarantine_segment(self, name: str) -> None:
+        """
+        Set an unreadable segment aside and drop it from the manifest;
+        its chunks lose their vectors and are removed from the store.
+        """
+        path = self._path(f"{name}.faiss")
+        logger.error("[RAG] Unreadable shard segment quarantined | shard=%s segment=%s", self.key, name)
+        if os.path.exists(path):
+            os.replace(path, path + QUARANTINE_SUFFIX)
+
+        manifest = dict(self.manifest, segments=[s for s in self.manifest["segments"] if s != name])
+        _write_json(self._path(MANIFEST), manifest)
+        self.manifest = manifest
+
+    def _referenced_files(self) -> Set[str]:
+        m = self.manifest
+        names = {MANIFEST, CHUNKS_DB, f"{CHUNKS_DB}-wal", f"{CHUNKS_DB}-shm"}
+        if m["base"]:
+            names.update(f"{m['base']}{ext}" for ext in (".faiss", ".ids.npy", ".vec.npy"))
+        for seg in m["segments"]:
+            names.add(f"{seg}.faiss")
+        names.update(f"{d}.npy" for d in m["deletes"])
+        return names
+
+    def _remove_unreferenced_files(self) -> None:
+        """Drop files from merged-away snapshots or interrupted writes."""
+        if not os.path.isdir(self.directory):
+            return
+
+        keep = self._referenced_files()
+        for name in os.listdir(self.directory):
+            if name not in keep and not name.endswith(QUARANTINE_SUFFIX):
+                try:
+                    os.remove(self._path(name))
+                except OSError:
+                    logger.warning("[RAG] Could not remove stale shard file | %s", name)
+
+    def save(self) -> None:
+        """
+        Persist changes since the last save as one new segment and/or
+        delete file, then atomically publish a new manifest.
+
+        Starts a background merge once segments / tombstones pile up.
+        """
+        self._flush()
+        if self.needs_merge():
+            self.merge_in_background()
+
+    def _take_pending(self) -> Tuple[List, List[int]]:
+        """
+        Detach unsaved changes. Caller holds the read lock (which keeps
+        writers out) and ``_io_lock`` (which keeps other flushes out).
+        """
+        adds, deletes = self._unsaved_adds, self._unsaved_deletes
+        self._unsaved_adds, self._unsaved_deletes = [], []
+        return adds, deletes
+
+    def _flush(self) -> None:
+        with self._io_lock:
+            with self._rw.read():
+                empty = self.index is None or not (self.live or self.staged)
+                adds, deletes = self._take_pending()
+                next_id = self.next_id
+
+            if empty:
+                self._clear_files()
+                return
+
+            self._write_pending(adds, deletes, next_id)
+
+    def _write_pending(self, adds: List, deletes: List[int], next_id: int) -> None:
+        """Write detached changes + a new manifest (``_io_lock`` held)."""
+        with self._rw.read():
+            staged = _id_ranges(self.staged)
+        if not adds and not deletes and staged == self.manifest.get("staged", []):
+            return
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            segments = list(self.manifest["segments"])
+            delete_files = list(self.manifest["deletes"])
+
+            if adds:
+                name = self._next_name("seg")
+                vectors = np.vstack([a[0] for a in adds])
+                ids = np.concatenate([a[1] for a in adds])
+
+                _atomic_write(
+                    self._path(f"{name}.faiss"),
+                    lambda tmp: faiss.write_index(_segment_index(vectors, ids), tmp),
+                )
+                segments.append(name)
+
+            if deletes:
+                name = self._next_name("del")
+                deleted = np.asarray(deletes, dtype=np.int64)
+                _atomic_write(self._path(f"{name}.npy"), lambda tmp: _write_npy(tmp, deleted))
+                delete_files.append(name)
+
+            manifest = dict(
+                self.manifest,
+                segments=segments,
+                deletes=delete_files,
+                staged=staged,
+                next_id=next_id,
+            )
+            _write_json(self._path(MANIFEST), manifest)
+            self.manifest = manifest
+        except Exception:
+            # Keep the changes for the next save
+            with self._rw.write():
+                self._unsaved_adds[:0] = adds
+                self._unsaved_deletes[:0] = deletes
+            raise
+
+        logger.info(
+            "[RAG] Shard saved | shard=%s segments=%d",
+            self.key,
+            len(self.manifest["segments"]),
+        )
+
+    def _clear_files(self) -> None:
+        """Drop an emptied shard (``_io_lock`` held)."""
+        with self._rw.write():
+            if self.index is not None and (self.live or self.staged):
+                return  # refilled meanwhile
+
+            self.index = None
+            self.mapped = False
+            self.delta = None
+            self._delta_ids = set()
+            self.exact = None
+            self.tombstones.clear()
+            self._unsaved_adds.clear()
+            self._unsaved_deletes.clear()
+            self._epoch += 1
+            if self.store is not None:
+                self.store.clear()
+
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if not name.startswith(CHUNKS_DB):
+                    os.remove(self._path(name))
+
+        self.manifest = {
+            "gen": self.manifest["gen"],
+            "docstore": "sqlite",
+            "next_id": self.next_id,
+            "base": None,
+            "segments": [],
+            "deletes": [],
+        }
+
+    # ---------------- mutation ----------------
+
+    def embed(self, docs: List[Document]) -> np.ndarray:
+        """Embed chunk texts. Runs without any lock held."""
+        return np.asarray(
+            self.embeddings.embed_documents([d.page_content for d in docs]),
+            dtype=np.float32,
+        )
+
+    def add_embedded(self, docs: List[Document], vectors: np.ndarray) -> List[int]:
+        """
+        Publish ``docs`` with precomputed ``vectors`` in one short
+        exclusive step; returns their vector IDs (input order).
+
+        Searches see either none or all of them.
+        """
+        return self._add(docs, vectors, self.live)
+
+    def stage(self, docs: List[Document], vectors: np.ndarray) -> List[int]:
+        """
+        Store ``docs`` like ``add_embedded`` but keep them out of searches
+        until ``publish()``; returns their vector IDs (input order).
+        """
+        return self._add(docs, vectors, self.staged)
+
+    def _add(self, docs: List[Document], vectors: np.ndarray, into: Set[int]) -> List[int]:
+        if not docs:
+            return []
+
+        with self._io_lock:
+            store = self._open_store()
+
+        with self._rw.write():
+            if self.index is None:
+                self.index = faiss.IndexIDMap2(faiss.IndexFlatL2(vectors.shape[1]))
+
+            ids = np.arange(self.next_id, self.next_id + len(docs), dtype=np.int64)
+            # One WAL commit, no fsync: cheap enough to hold the lock for
+            store.add(ids.tolist(), docs)
+            self._store(ids, vectors)
+            self.next_id += len(docs)
+
+            into.update(ids.tolist())
+            self._unsaved_adds.append((vectors, ids))
+
+        return ids.tolist()
+
+    def publish(self, ids: List[int]) -> None:
+        """Make staged ``ids`` searchable, all in one step."""
+        with self._rw.write():
+            self.staged.difference_update(ids)
+            self.live.update(ids)
+
+    def discard(self, ids: List[int]) -> None:
+        """Drop staged ``ids`` (an ingest that failed half way)."""
+        with self._rw.write():
+            ids = [vid for vid in ids if vid in self.staged]
+            if not ids:
+                return
+
+            self.store.delete(ids)
+            self.staged.difference_update(ids)
+            self.tombstones.update(ids)
+            if self.exact is not None:
+                self.exact.discard(ids)
+            self._unsaved_deletes.extend(ids)
+
+    def add_documents(self, docs: List[Document]) -> List[int]:
+        """Embed and add ``docs``; returns their vector IDs (input order)."""
+        if not docs:
+            return []
+        return self.add_embedded(docs, self.embed(docs))
+
+    def delete_file(self, file_id: str) -> int:
+        """
+        Tombstone every chunk of ``file_id``. Returns the number removed.
+
+        Cost depends on the size of the deleted document only; the
+        vectors are reclaimed by the next merge.
+        """
+        with self._rw.write():
+            ids = self._file_vector_ids(file_id)
+            if not ids:
+                return 0
+
+            self.store.delete(ids)
+            self.live.difference_update(ids)
+            self.tombstones.update(ids)
+            if self.exact is not None:
+                self.exact.discard(ids)
+            self._unsaved_deletes.extend(ids)
+
+            return len(ids)
+
+    def _layout(self) -> Tuple[str, str]:
+        return index_kind(self.index), index_codec(self.index)
+
+    def _target_layout(self) -> Tuple[str, str]:
+        n = len(self.live)
+        return (
+            choose_index_kind(n, index_kind(self.index)),
+            choose_codec(n, index_codec(self.index)),
+        )
+
+    def needs_rebuild(self) -> bool:
+        """True if the shard's size calls for a different index type / codec."""
+        with self._rw.read():
+            return self._target_layout() != self._layout()
+
+    def needs_merge(self) -> bool:
+        with self._rw.read():
+            if self.index is None:
+                return False
+            if self._target_layout() != self._layout():
+                return True
+            if len(self.manifest["segments"]) >= MERGE_MAX_SEGMENTS:
+                return True
+            return bool(self.tombstones) and (
+                len(self.tombstones) >= COMPACT_TOMBSTONE_RATIO * self._ntotal()
+            )
+
+    def merge(self) -> int:
+        """
+        Fold all segments and deletes into a new compacted base.
+
+        Copy-on-write: the new index is built from a snapshot without
+        blocking searches (a flat float32 index is cloned and compacted;
+        a shard that needs a different index type / codec, or an ANN /
+        quantized index with tombstones, is rebuilt from its live
+        full-precision vectors), written as the base, then swapped in
+        under a short exclusive lock. A memory-mapped base is not cloned:
+        the new index starts from a private read of the base file plus the
+        delta. Returns slots reclaimed.
+        """
+        with self._merge_lock:
+            return self._merge()
+
+    def _merge(self) -> int:
+        # ---- 1. snapshot: searches continue, writers wait ----
+        with self._io_lock:
+            with self._rw.read():
+                empty = self.index is None or not (self.live or self.staged)
+                if not empty:
+                    adds, deletes = self._take_pending()
+                    kind, codec = self._target_layout()
+                    rebuild = (kind, codec) != self._layout() or (
+                        (kind, codec) != ("flat", "none") and bool(self.tombstones)
+                    )
+                    epoch = self._epoch
+                    watermark = self.next_id
+                    stored_total = self._ntotal()
+                    dead = set(self.tombstones)
+
+                    ids = vectors = None
+                    if rebuild or codec != "none":
+                        ids, vectors = self._live_vectors()
+
+                    snapshot = base_path = delta = None
+                    if not rebuild and self.mapped:
+                        base_path = self._path(f"{self.manifest['base']}.faiss")
+                        delta = self._delta_vectors()
+                    elif not rebuild:
+                        snapshot = faiss.clone_index(self.index)
+
+            if empty:
+                self._flush()
+                return 0
+
+            # Unsaved changes land in a segment first so the snapshot
+            # is exactly "everything on disk".
+            self._write_pending(adds, deletes, watermark)
+            folded_segments = list(self.manifest["segments"])
+            folded_deletes = list(self.manifest["deletes"])
+            name = self._next_name("base")
+
+        # ---- 2. build + write the new base (no locks) ----
+        if rebuild:
+            snapshot = build_index(kind, vectors, ids, codec)
+            reclaimed = int(stored_total - len(ids))
+        else:
+            if snapshot is None:
+                # Base files never change once written, so this equals
+                # the mapped base
+                snapshot = faiss.read_index(base_path)
+                if len(delta[0]):
+                    snapshot.add_with_ids(delta[1], delta[0])
+            reclaimed = snapshot.remove_ids(_id_selector(dead)) if dead else 0
+
+        if codec != "none":
+            ExactVectorStore.write(self._path(name), ids, vectors)
+        del vectors
+
+        _atomic_write(self._path(f"{name}.faiss"), lambda tmp: faiss.write_index(snapshot, tmp))
+
+        # Serve the new base from the page cache too
+        mapped = False
+        if _can_map(kind):
+            reopened, mapped = _open_base(self._path(f"{name}.faiss"))
+            if mapped:
+                snapshot = reopened
+
+        # ---- 3. swap ----
+        with self._io_lock:
+            with self._rw.write():
+                if self._epoch != epoch:
+                    # Shard was emptied meanwhile; the new base is stale
+                    swapped = False
+                else:
+                    # Catch up with chunks added since the snapshot; they
+                    # are already in later segments, so the base written
+                    # above must not include them.
+                    late = [
+                        vid for vid in range(watermark, self.next_id)
+                        if vid in self.live or vid in self.staged
+                    ]
+                    late_ids = np.asarray(late, dtype=np.int64)
+                    late_vectors = self._vectors(late) if late else None
+
+                    self.index = snapshot
+                    self.mapped = mapped
+                    self.delta = None
+                    self._delta_ids = set()
+                    self.exact = ExactVectorStore.open(self._path(name)) if codec != "none" else None
+                    if late:
+                        self._store(late_ids, late_vectors)
+                    # Only deletes made since the snapshot are still in the index
+                    self.tombstones = {
+                        vid for vid in self.tombstones - dead if vid < watermark
+                    }
+                    swapped = True
+
+            if swapped:
+                manifest = dict(
+                    self.manifest,
+                    base=name,
+                    segments=[s for s in self.manifest["segments"] if s not in folded_segments],
+                    deletes=[d for d in self.manifest["deletes"] if d not in folded_deletes],
+                    staged=_id_ranges(self.staged),
+                    next_id=max(self.manifest.get("next_id", 0), watermark),
+                )
+                _write_json(self._path(MANIFEST), manifest)
+                self.manifest = manifest
+            self._remove_unreferenced_files()
+
+        if not swapped:
+            return 0
+
+        logger.info(
+            "[RAG] Shard merged | shard=%s base=%s type=%s codec=%s segments_folded=%d reclaimed=%d",
+            self.key,
+            name,
+            kind,
+            codec,
+            len(folded_segments),
+            reclaimed,
+        )
+        return reclaimed
+
+    def _live_vectors(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Full-precision ``(ids, vectors)`` of live and staged chunks, sorted by ID."""
+        live_ids = np.fromiter(self.live | self.staged, dtype=np.int64)
+        if self.exact is not None:
+            ids, vectors = self.exact.select(live_ids)
+        else:
+            stored = self._stored_ids()
+            live = np.isin(stored, live_ids)
+            ids = stored[live]
+            vectors = self.index.index.reconstruct_n(0, self.index.ntotal)
+            if self.delta is not None:
+                vectors = np.vstack([vectors, self.delta.index.reconstruct_n(0, self.delta.ntotal)])
+            vectors = vectors[live]
+        order = np.argsort(ids)
+        return ids[order], vectors[order]
+
+    def _delta_vectors(self) -> Tuple[np.ndarray, np.ndarray]:
+        """``(ids, vectors)`` held in the delta index (all of them)."""
+        if self.delta is None:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, self.index.d), dtype=np.float32)
+        ids = faiss.vector_to_array(self.delta.id_map).astype(np.int64)
+        return ids, self.delta.index.reconstruct_n(0, self.delta.ntotal)
+
+    def merge_in_background(self) -> None:
+        with self._io_lock:
+            if self._merging:
+                return
+            self._merging = True
+
+        def run() -> None:
+            try:
+                self.merge()
+            except Exception:
+                logger.exception("[RAG] Shard merge failed | shard=%s", self.key)
+            finally:
+                self._merging = False
+
+        threading.Thread(target=run, name=f"shard-merge-{self.key}", daemon=True).start()
+
+    # ---------------- read ----------------
+
+    def search_vector(
+        self,
+        vector: np.ndarray,
+        k: int,
+        file_id: Optional[str] = None,
+        *,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ) -> List[Tuple[int, float]]:
+        """
+        Nearest ``(vector_id, squared_l2_distance)`` pairs, best first.
+
+        With ``file_id`` the search is restricted to that file's vector
+        IDs (live by construction), so it returns ``min(k, chunks in
+        file)`` hits and skips every other document. On a flat index the
+        IDs go to FAISS as a selector; on an ANN index, whose graph /
+        lists a tiny selector would starve, the file's vectors are
+        scored exactly.
+
+        ``nprobe`` (IVF) and ``ef_search`` (HNSW) override the defaults
+        for this query only. On a quantized index RERANK_FACTOR x k
+        candidates are re-ranked on their full-precision vectors.
+        """
+        query = np.asarray(vector, dtype=np.float32).reshape(1, -1)
+
+        with self._rw.read():
+            if self.index is None or not self.live:
+                return []
+
+            if file_id is not None:
+                live = self._file_vector_ids(file_id)
+                if not live:
+                    return []
+                k = min(k, len(live))
+
+                if index_kind(self.index) != "flat" or not _supports_selector(self.index):
+                    dist = self._distances(query, live)
+                    top = np.argsort(dist)[:k]
+                    return [(live[i], float(dist[i])) for i in top]
+
+                selector = _id_selector(live)
+            else:
+                hidden = self.tombstones | self.staged if self.staged else self.tombstones
+                if hidden and _supports_selector(self.index):
+                    # keep the inner selector referenced for the search call
+                    inner = _id_selector(hidden)
+                    selector = faiss.IDSelectorNot(inner)
+                else:
+                    selector = None
+
+            fetch_k = k if self.exact is None else max(k * RERANK_FACTOR, RERANK_MIN)
+            if selector is None and (self.tombstones or self.staged):
+                # Hidden IDs are dropped below instead of inside FAISS
+                fetch_k += len(self.tombstones) + len(self.staged)
+            params = _search_params(self.index, selector, nprobe, ef_search)
+            distances, ids = self.index.search(query, fetch_k, params=params)
+            found = list(zip(ids[0].tolist(), distances[0].tolist()))
+
+            if self.delta is not None and self.delta.ntotal:
+                params = _search_params(self.delta, selector, None, None)
+                distances, ids = self.delta.search(query, fetch_k, params=params)
+                found = sorted(found + list(zip(ids[0].tolist(), distances[0].tolist())), key=lambda h: h[1])
+
+            hits = [
+                (vid, dist)
+                for vid, dist in found
+                if vid != -1 and vid in self.live
+            ]
+
+            if self.exact is None or not hits:
+                return hits[:k]
+
+            candidates = [vid for vid, _ in hits]
+            exact = self._distances(query, candidates)
+            return [(candidates[i], float(exact[i])) for i in np.argsort(exact)[:k]]
+
+    def document(self, vector_id: int) -> Optional[Document]:
+        with self._rw.read():
+            if vector_id not in self.live:
+                return None
+            return self.store.get(vector_id)
+
+    def file_vector_ids(self, file_id: str) -> List[int]:
+        """Live vector IDs of ``file_id``'s chunks."""
+        with self._rw.read():
+            return self._file_vector_ids(file_id)
+
+    def _file_vector_ids(self, file_id: str) -> List[int]:
+        if self.store is None:
+            return []
+        return [vid for vid in self.store.file_ids(file_id) if vid in self.live]
+
+    def distances(self, vector: np.ndarray, ids: List[int]) -> np.ndarray:
+        """Exact squared L2 distance from ``vector`` to stored ``ids``."""
+        with self._rw.read():
+            return self._distances(vector, ids)
+
+    def _distances(self, vector: np.ndarray, ids: List[int]) -> np.ndarray:
+        if self.index is None or not ids:
+            return np.zeros(0, dtype=np.float32)
+        diff = self._vectors(ids) - np.asarray(vector, dtype=np.float32).reshape(1, -1)
+        return (diff * diff).sum(axis=1)
+
+    def vectors(self, ids: List[int]) -> np.ndarray:
+        """Stored full-precision vectors for ``ids``."""
+        with self._rw.read():
+            if self.index is None or not ids:
+                return np.zeros((0, 0), dtype=np.float32)
+            return self._vectors(ids)
+
+    def _vectors(self, ids: List[int]) -> np.ndarray:
+        if self.exact is not None:
+            return self.exact.get(ids)
+        return np.vstack([
+            (self.delta if vid in self._delta_ids else self.index).reconstruct(int(vid))
+            for vid in ids
+        ])
+
+    def search(self, query: str, k: int, file_id: Optional[str] = None) -> List[Document]:
+        vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        return [
+            doc
+            for doc in (self.document(vid) for vid, _ in self.search_vector(vector, k, file_id))
+            if doc is not None
+        ]
+
+    def preview(self, limit: int) -> List[str]:
+        with self._rw.read():
+            return self.store.head(limit) if self.store is not None else []
+
+# ==================================================
+# SHARD REGISTRY
+# ==================================================
+
+class ShardRegistry:
+    """
+    Lazily loads and caches one ``VectorShard`` per user.
+    """
+
+    def __init__(self, root: str, embeddings: Embeddings) -> None:
+        self.root = root
+        self.embeddings = embeddings
+        self._shards: Dict[str, VectorShard] = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(root, exist_ok=True)
+        self._migrate_legacy_index()
+
+    def _migrate_legacy_index(self) -> None:
+        """
+        Move the old single global index into the default shard.
+
+        Before sharding every upload was made as the "default" user,
+        so the global index belongs to that tenant.
+        """
+        legacy = os.path.join(self.root, "index.faiss")
+        if not os.path.exists(legacy):
+            return
+
+        target = os.path.join(self.root, _shard_dirname(DEFAULT_SHARD))
+        if os.path.isdir(target) and os.listdir(target):
+            logger.warning("[RAG] Legacy index ignored, default shard already exists")
+            return
+
+        os.makedirs(target, exist_ok=True)
+        for name in INDEX_FILES:
+            src = os.path.join(self.root, name)
+            if os.path.exists(src):
+                shutil.move(src, os.path.join(target, name))
+
+        logger.info("[RAG] Legacy global index migrated to default shard")
+
+    def get(self, user_id: Optional[str]) -> VectorShard:
+        key = shard_key(user_id)
+
+        shard = self._shards.get(key)
+        if shard is not None:
+            return shard
+
+        with self._lock:
+            shard = self._shards.get(key)
+            if shard is None:
+                shard = VectorShard(
+                    key,
+                    os.path.join(self.root, _shard_dirname(key)),
+                    self.embeddings,
+                )
+                shard.load()
+                self._shards[key] = shard
+
+        return shard
@@ -801,6 +801,8 @@ def chatpage_stream():
             context=None,
             mode=payload.get("mode"),
             file_id=payload.get("file_id"),
+            file_ids=payload.get("file_ids"),
+            collection=payload.get("collection"),
         ):
             yield f"data: {token}\n\n"
 
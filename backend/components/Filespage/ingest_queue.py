@@ -0,0 +1,198 @@
+"""
+Background RAG ingestion queue (Files page).
+
+Responsibilities:
+- Take OCR / embedding / index save off the upload request
+- Run jobs on a small, bounded worker pool
+- Persist every job so unfinished work resumes after a restart
+- Refuse new jobs when the backlog is full (admission control)
+
+Job lifecycle (mirrored on the file record):
+    uploaded → extracting → embedding → indexed | failed
+
+OCR runs in its own lower-priority processes (see RAG.extraction); the
+worker threads here keep the process's normal priority.
+"""
+
+from __future__ import annotations
+
+import json
+import queue
+import sqlite3
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATES = ("indexed", "failed")
+
+# Runner signature: run(record, persist). The runner updates the record's
+# status / progress in place and calls persist(record) after each change.
+JobRunner = Callable[[Dict, Callable[[Dict], None]], None]
+
+
+class QueueFullError(RuntimeError):
+    """Raised when the ingestion backlog is at its admission limit."""
+
+
+class IngestJobQueue:
+    """
+    SQLite-persisted job queue with a fixed number of worker threads.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        runner: JobRunner,
+        *,
+        workers: int = 1,
+        max_pending: int = 32,
+    ) -> None:
+        self.db_path = db_path
+        self.runner = runner
+        self.workers = workers
+        self.max_pending = max_pending
+
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._records: Dict[str, Dict] = {}
+        self._pending = 0
+
+        self._lock = threading.Lock()
+        self._started = False
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ingest_jobs ("
+            " file_id TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL,"
+            " record TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    # --------------------------------------------------
+    # Persistence
+    # --------------------------------------------------
+
+    def _persist(self, record: Dict) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ingest_jobs (file_id, status, record) VALUES (?, ?, ?)",
+                (record["id"], record["status"], json.dumps(record)),
+            )
+            self._conn.commit()
+
+    def load_records(self) -> List[Dict]:
+        """
+        Return every persisted file record (restart recovery).
+
+        Unfinished jobs are reset to "uploaded" and re-enqueued once
+        the workers start.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT record FROM ingest_jobs").fetchall()
+
+        records = []
+        for (raw,) in rows:
+            record = json.loads(raw)
+            self._records[record["id"]] = record
+
+            if record["status"] not in TERMINAL_STATES:
+                record["status"] = "uploaded"
+                record["progress"] = 0.0
+                self._pending += 1
+                self._queue.put(record["id"])
+
+            records.append(record)
+
+        return records
+
+    def remove(self, file_id: str) -> None:
+        with self._lock:
+            self._records.pop(file_id, None)
+            self._conn.execute("DELETE FROM ingest_jobs WHERE file_id = ?", (file_id,))
+            self._conn.commit()
+
+    # --------------------------------------------------
+    # Producer side
+    # --------------------------------------------------
+
+    def submit(self, record: Dict) -> None:
+        """
+        Enqueue a file record. Raises QueueFullError past max_pending.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFullError(
+                    f"Ingestion queue full ({self._pending} pending)"
+                )
+            self._pending += 1
+            self._records[record["id"]] = record
+
+        self._persist(record)
+        self._queue.put(record["id"])
+        self.ensure_started()
+
+    def update(self, record: Dict) -> None:
+        """Persist a status / progress change (ignored once removed)."""
+        if record["id"] in self._records:
+            self._persist(record)
+
+    # --------------------------------------------------
+    # Workers
+    # --------------------------------------------------
+
+    def ensure_started(self) -> None:
+        """
+        Start worker threads on first use.
+
+        Lazy so that processes that never serve requests (e.g. the
+        Werkzeug reloader parent) do not also run recovered jobs.
+        """
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+
+        for n in range(self.workers):
+            threading.Thread(
+                target=self._work,
+                name=f"ingest-worker-{n}",
+                daemon=True,
+            ).start()
+
+        logger.info("[FILES] Ingestion workers started | workers=%d", self.workers)
+
+    def _work(self) -> None:
+        while True:
+            file_id = self._queue.get()
+            record = self._records.get(file_id)
+
+            try:
+                if record is not None:
+                    self._run(record)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                self._queue.task_done()
+
+    def _run(self, record: Dict) -> None:
+        try:
+            self.runner(record, self.update)
+        except Exception:
+            # Runner records the failure on the record itself
+            logger.exception("[FILES] Ingestion job crashed | file=%s", record["id"])
+
+        self.update(record)
+
+    # --------------------------------------------------
+    # Introspection
+    # --------------------------------------------------
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def get(self, file_id: str) -> Optional[Dict]:
+        return self._records.get(file_id)
@@ -7,6 +7,7 @@ Responsibilities:
 - Ingest files directly into SINGLE-FILE RAG engine
 - List, delete, and inspect files
 - Expose FULL extracted document text (page-wise)
+- Manage named collections of files (multi-document chat)
 - Maintain strict file_id consistency across the system
 """
 
@@ -14,6 +15,7 @@ from __future__ import annotations
 
 import os
 import uuid
+import hashlib
 import logging
 
 from flask import Blueprint, request, jsonify
@@ -22,12 +24,23 @@ from werkzeug.utils import secure_filename
 from .service import (
     save_file_metadata,
     get_all_files,
+    get_file,
     delete_file,
     UPLOAD_DIR,
+    ASYNC_INGESTION,
 )
+from .ingest_queue import QueueFullError
 
 # Authoritative raw-text access (RAG owns extraction)
-from RAG.rag_engine import get_raw_text
+from RAG.rag_engine import get_raw_text, get_raw_text_page_count
+
+# Named collections (multi-document chat scopes)
+from RAG.rag_engine import (
+    set_collection,
+    get_collection,
+    list_collections,
+    delete_collection,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -56,6 +69,35 @@ def _get_user_id() -> str:
     return "default"
 
 
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+def _save_and_hash(file, path: str) -> str:
+    """
+    Stream the upload to ``path`` and return its SHA-256 (hex).
+
+    Hashing happens on the same pass as the write, so duplicate
+    detection costs no extra read of the file.
+    """
+    digest = hashlib.sha256()
+    with open(path, "wb") as out:
+        while True:
+            chunk = file.stream.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+    return digest.hexdigest()
+
+
+def _discard_upload(path: str) -> None:
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+    except Exception:
+        pass
+
+
 # ------------------------------------------------------------------
 # List files
 # ------------------------------------------------------------------
@@ -79,6 +121,9 @@ def upload_file():
     """
     Upload a file and ingest it into the SINGLE-FILE RAG engine.
 
+    With ASYNC_INGESTION the response is 202 as soon as the ingestion
+    job is queued; poll GET /api/files/<file_id>/status for progress.
+
     CRITICAL GUARANTEES:
     - file_id is generated ONCE
     - file_id is shared across:
@@ -87,6 +132,9 @@ def upload_file():
         - FAISS vectors
         - frontend APIs
     - No renaming, no temp files, no race conditions
+
+    Byte-identical uploads (same SHA-256) still get their own file_id
+    but reuse the stored extraction and embeddings.
     """
 
     # -----------------------------
@@ -122,7 +170,7 @@ def upload_file():
     # -----------------------------
 
     try:
-        file.save(final_path)
+        content_hash = _save_and_hash(file, final_path)
     except Exception:
         logger.exception("[FILES] Failed to write file to disk")
         return jsonify({"error": "Failed to save file"}), 500
@@ -138,8 +186,26 @@ def upload_file():
             mimetype=file.mimetype or "application/octet-stream",
             file_path=final_path,
             user_id=user_id,
+            content_hash=content_hash,
         )
 
+        if ASYNC_INGESTION:
+            logger.info(
+                "[FILES] Upload accepted, ingestion queued | file=%s user=%s",
+                file_id,
+                user_id,
+            )
+
+            response = jsonify(
+                {
+                    "success": True,
+                    "file": record,
+                    "status_url": f"/api/files/{file_id}/status",
+                }
+            )
+            response.headers["Location"] = f"/api/files/{file_id}/status"
+            return response, 202
+
         logger.info(
             "[FILES] Upload + ingestion successful | file=%s user=%s",
             file_id,
@@ -153,15 +219,24 @@ def upload_file():
             }
         ), 201
 
+    except QueueFullError as exc:
+        logger.warning("[FILES] Upload rejected, ingestion queue full | file=%s", file_id)
+        _discard_upload(final_path)
+
+        response = jsonify(
+            {
+                "error": "Too many documents are being processed, try again shortly",
+                "details": str(exc),
+            }
+        )
+        response.headers["Retry-After"] = "30"
+        return response, 429
+
     except Exception as exc:
         logger.exception("[FILES] Metadata save or RAG ingestion failed")
 
         # Cleanup partially written file
-        try:
-            if os.path.exists(final_path):
-                os.remove(final_path)
-        except Exception:
-            pass
+        _discard_upload(final_path)
 
         return jsonify(
             {
@@ -171,6 +246,34 @@ def upload_file():
         ), 500
 
 
+# ------------------------------------------------------------------
+# Ingestion status (poll after a 202 upload)
+# ------------------------------------------------------------------
+
+@files_bp.route("/<file_id>/status", methods=["GET"])
+def get_file_status(file_id: str):
+    """
+    Return ingestion progress for a file.
+
+    status: uploaded → extracting → embedding → indexed | failed
+    progress: 0.0 – 1.0 within the current stage
+    """
+    record = get_file(file_id, user_id=_get_user_id())
+
+    if record is None:
+        return jsonify({"error": "File not found", "file_id": file_id}), 404
+
+    return jsonify(
+        {
+            "file_id": file_id,
+            "status": record["status"],
+            "progress": record.get("progress", 0.0),
+            "error": record.get("error"),
+            "updatedAt": record["updatedAt"],
+        }
+    ), 200
+
+
 # ------------------------------------------------------------------
 # Get FULL extracted text (PAGE-WISE, AUTHORITATIVE)
 # ------------------------------------------------------------------
@@ -178,18 +281,32 @@ def upload_file():
 @files_bp.route("/<file_id>/text", methods=["GET"])
 def get_file_text(file_id: str):
     """
-    Return FULL extracted text from the document.
+    Return extracted text from the document.
 
     IMPORTANT:
     - Deterministic (no LLM)
     - Page-wise text
     - Backed by persisted raw extraction
     - Used by FilesPage preview
+
+    Query params (optional):
+    - offset: first page to return, 0-based (default 0)
+    - limit:  number of pages to return (default: all)
     """
 
-    pages = get_raw_text(file_id)
+    try:
+        offset = int(request.args.get("offset", 0))
+        limit = request.args.get("limit")
+        limit = int(limit) if limit is not None else None
+    except ValueError:
+        return jsonify({"error": "offset and limit must be integers"}), 400
+
+    if offset < 0 or (limit is not None and limit < 0):
+        return jsonify({"error": "offset and limit must be non-negative"}), 400
 
-    if not pages:
+    page_count = get_raw_text_page_count(file_id)
+
+    if not page_count:
         return jsonify(
             {
                 "error": "No extracted text found for this file",
@@ -197,10 +314,14 @@ def get_file_text(file_id: str):
             }
         ), 404
 
+    pages = get_raw_text(file_id, offset=offset, limit=limit)
+
     return jsonify(
         {
             "file_id": file_id,
-            "page_count": len(pages),
+            "page_count": page_count,
+            "offset": offset,
+            "limit": limit,
             "pages": pages,
         }
     ), 200
@@ -220,10 +341,61 @@ def remove_file(file_id: str):
     - Acceptable for current architecture
     """
 
-    deleted = delete_file(file_id)
+    deleted = delete_file(file_id, user_id=_get_user_id())
 
     if not deleted:
         return jsonify({"error": "File not found"}), 404
 
     logger.info("[FILES] File metadata deleted | file=%s", file_id)
     return jsonify({"success": True}), 200
+
+
+# ------------------------------------------------------------------
+# Collections
+# ------------------------------------------------------------------
+
+@files_bp.route("/collections", methods=["GET"])
+def list_file_collections():
+    return jsonify({"collections": list_collections(user_id=_get_user_id())}), 200
+
+
+@files_bp.route("/collections/<name>", methods=["GET"])
+def get_file_collection(name: str):
+    file_ids = get_collection(name, user_id=_get_user_id())
+    if not file_ids:
+        return jsonify({"error": "Collection not found", "name": name}), 404
+
+    return jsonify({"name": name, "file_ids": file_ids}), 200
+
+
+@files_bp.route("/collections/<name>", methods=["PUT"])
+def put_file_collection(name: str):
+    """
+    Create or replace a collection.
+
+    Body: {"file_ids": ["<file_id>", ...]}
+    """
+    payload = request.get_json(silent=True) or {}
+    file_ids = payload.get("file_ids")
+
+    if not isinstance(file_ids, list) or not file_ids or not all(isinstance(f, str) for f in file_ids):
+        return jsonify({"error": "file_ids must be a non-empty list of file ids"}), 400
+
+    user_id = _get_user_id()
+    unknown = [f for f in file_ids if get_file(f, user_id=user_id) is None]
+    if unknown:
+        return jsonify({"error": "Unknown file ids", "file_ids": unknown}), 400
+
+    stored = set_collection(name, file_ids, user_id=user_id)
+
+    logger.info("[FILES] Collection saved | name=%s files=%d", name, len(stored))
+    return jsonify({"name": name, "file_ids": stored}), 200
+
+
+@files_bp.route("/collections/<name>", methods=["DELETE"])
+def remove_file_collection(name: str):
+    if not delete_collection(name, user_id=_get_user_id()):
+        return jsonify({"error": "Collection not found", "name": name}), 404
+
+    logger.info("[FILES] Collection deleted | name=%s", name)
+    return jsonify({"success": True}), 200
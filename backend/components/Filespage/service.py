@@ -4,7 +4,7 @@ File metadata store (UI-level) + RAG ingestion bridge (ENTERPRISE).
 Responsibilities:
 - Track uploaded files for Files page
 - Persist upload metadata
-- Ingest files into the RAG engine
+- Ingest files into the RAG engine (inline or via background queue)
 - Keep Files page and Chat page in sync
 
 CRITICAL GUARANTEES:
@@ -25,14 +25,17 @@ from __future__ import annotations
 import os
 import uuid
 import logging
+import threading
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
 
 # --------------------------------------------------
 # AUTHORITATIVE RAG ENGINE
 # --------------------------------------------------
 
-from RAG.rag_engine import ingest_file, delete_document
+from RAG.rag_engine import ingest_file, delete_document, remove_from_collections
+
+from .ingest_queue import IngestJobQueue
 
 logger = logging.getLogger(__name__)
 
@@ -48,10 +51,17 @@ FILES_DB: Dict[str, List[Dict]] = {}
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-# Feature flags (future-proof)
-ASYNC_INGESTION = False   # flip later (Celery / RQ / background workers)
+# Feature flags
+# Off by default: with it the upload returns 202 before the document is
+# indexed, and the chat page does not poll /status or handle 429 yet
+ASYNC_INGESTION = os.getenv("ASYNC_INGESTION", "0") == "1"
 ENABLE_VECTOR_CLEANUP = True
 
+# Background ingestion (ASYNC_INGESTION)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "32"))
+INGEST_JOBS_DB = os.path.join(UPLOAD_DIR, "ingest_jobs.sqlite3")
+
 # --------------------------------------------------
 # Helpers
 # --------------------------------------------------
@@ -65,6 +75,98 @@ def _require_file_exists(path: str) -> None:
     if not os.path.exists(path):
         raise FileNotFoundError(f"File path does not exist: {path}")
 
+
+def _set_stage(record: Dict, stage: str, fraction: float) -> None:
+    record["status"] = stage
+    record["progress"] = round(min(max(fraction, 0.0), 1.0), 3)
+    record["updatedAt"] = _now()
+
+# --------------------------------------------------
+# RAG ingestion (authoritative)
+# --------------------------------------------------
+
+def _run_ingestion(record: Dict, persist: Callable[[Dict], None] = lambda r: None) -> None:
+    """
+    Ingest one file record into the RAG engine.
+
+    Used inline (ASYNC_INGESTION off) and as the background job
+    runner. Never raises: failures are recorded on the record.
+    """
+    fid = record["id"]
+
+    def progress(stage: str, fraction: float) -> None:
+        _set_stage(record, stage, fraction)
+        persist(record)
+
+    try:
+        logger.info(
+            "[FILES] Starting RAG ingestion | file=%s path=%s",
+            fid,
+            record["path"],
+        )
+
+        # A resumed job may have died half way; start from a clean slate
+        delete_document(file_id=fid, user_id=record["user_id"])
+
+        ingest_file(
+            file_id=fid,       # CRITICAL: same ID everywhere
+            file_path=record["path"],
+            mimetype=record["type"],
+            user_id=record["user_id"],       # vectors live in the user's shard
+            progress=progress,
+            content_hash=record.get("content_hash"),   # duplicate uploads skip OCR + embedding
+        )
+
+        record["status"] = "indexed"
+        record["progress"] = 1.0
+        record["updatedAt"] = _now()
+
+        logger.info(
+            "[FILES] RAG ingestion completed | file=%s",
+            fid,
+        )
+
+    except Exception as exc:
+        record["status"] = "failed"
+        record["error"] = str(exc)
+        record["updatedAt"] = _now()
+
+        logger.exception(
+            "[FILES] RAG ingestion failed | file=%s",
+            fid,
+        )
+
+    # Deleted while it was being ingested: drop what was just indexed
+    if ASYNC_INGESTION and _ingest_queue().get(fid) is None:
+        delete_document(file_id=fid, user_id=record["user_id"])
+
+
+# Built on first use, and only with ASYNC_INGESTION
+INGEST_QUEUE: Optional[IngestJobQueue] = None
+_INGEST_QUEUE_LOCK = threading.Lock()
+
+
+def _ingest_queue() -> IngestJobQueue:
+    """
+    The background job queue.
+
+    Restart recovery: queued uploads are restored into FILES_DB when it
+    is created (unfinished ones are resumed as soon as the workers start).
+    """
+    global INGEST_QUEUE
+    with _INGEST_QUEUE_LOCK:
+        if INGEST_QUEUE is None:
+            jobs = IngestJobQueue(
+                INGEST_JOBS_DB,
+                _run_ingestion,
+                workers=INGEST_WORKERS,
+                max_pending=INGEST_MAX_PENDING,
+            )
+            for record in jobs.load_records():
+                FILES_DB.setdefault(record["user_id"], []).append(record)
+            INGEST_QUEUE = jobs
+        return INGEST_QUEUE
+
 # --------------------------------------------------
 # Write path (UPLOAD + INGEST)
 # --------------------------------------------------
@@ -76,10 +178,15 @@ def save_file_metadata(
     file_path: str,
     user_id: Optional[str] = None,
     file_id: Optional[str] = None,
+    content_hash: Optional[str] = None,
 ) -> Dict:
     """
     Save file metadata AND ingest into the RAG engine.
 
+    With ASYNC_INGESTION the record is returned as soon as the job is
+    queued (status "uploaded"); raises QueueFullError when the backlog
+    is at its admission limit.
+
     HARD RULES:
     - file_path MUST be final (already written)
     - file_id MUST be generated exactly once
@@ -96,12 +203,29 @@ def save_file_metadata(
         "type": mimetype,
         "path": file_path,
         "user_id": uid,
+        "content_hash": content_hash,
         "uploadedAt": _now(),
         "updatedAt": _now(),
-        "status": "uploaded",   # uploaded → indexed | failed
+        "status": "uploaded",   # uploaded → extracting → embedding → indexed | failed
+        "progress": 0.0,
         "error": None,
     }
 
+    if ASYNC_INGESTION:
+        # Admission control BEFORE the record becomes visible
+        jobs = _ingest_queue()
+        jobs.submit(record)              # may raise QueueFullError
+        FILES_DB.setdefault(uid, []).append(record)
+
+        logger.info(
+            "[FILES] Uploaded, ingestion queued | file=%s name=%s user=%s pending=%d",
+            fid,
+            filename,
+            uid,
+            jobs.pending,
+        )
+        return record
+
     FILES_DB.setdefault(uid, []).append(record)
 
     logger.info(
@@ -111,45 +235,7 @@ def save_file_metadata(
         uid,
     )
 
-    # --------------------------------------------------
-    # RAG ingestion (authoritative)
-    # --------------------------------------------------
-
-    try:
-        logger.info(
-            "[FILES] Starting RAG ingestion | file=%s path=%s",
-            fid,
-            file_path,
-        )
-
-        if ASYNC_INGESTION:
-            # enqueue_ingestion_job(fid, file_path, mimetype)
-            pass
-        else:
-            ingest_file(
-                file_id=fid,       # CRITICAL: same ID everywhere
-                file_path=file_path,
-                mimetype=mimetype,
-            )
-
-        record["status"] = "indexed"
-        record["updatedAt"] = _now()
-
-        logger.info(
-            "[FILES] RAG ingestion completed | file=%s",
-            fid,
-        )
-
-    except Exception as exc:
-        record["status"] = "failed"
-        record["error"] = str(exc)
-        record["updatedAt"] = _now()
-
-        logger.exception(
-            "[FILES] RAG ingestion failed | file=%s",
-            fid,
-        )
-
+    _run_ingestion(record)
     return record
 
 # --------------------------------------------------
@@ -160,6 +246,9 @@ def get_all_files(*, user_id: Optional[str] = None) -> List[Dict]:
     """
     Return all uploaded files visible to the user.
     """
+    if ASYNC_INGESTION:
+        _ingest_queue().ensure_started()
+
     if user_id:
         return FILES_DB.get(user_id, [])
     # admin / debug view
@@ -201,6 +290,11 @@ def delete_file(file_id: str, *, user_id: Optional[str] = None) -> bool:
     if deleted:
         logger.info("[FILES] Deleted | file=%s user=%s", file_id, uid)
 
+        if ASYNC_INGESTION:
+            _ingest_queue().remove(file_id)
+
+        remove_from_collections(file_id, user_id=uid)
+
         if ENABLE_VECTOR_CLEANUP:
             try:
                 delete_document(file_id=file_id, user_id=uid)
@@ -7,15 +7,19 @@ Key guarantees:
 - NO embedded 'data:' leakage
 - Frontend-safe streaming
 - RAG used ONLY when document intent is detected
+- Document answers streamed like plain chat (full documents page by page)
+- A question can cover one file, a list of files or a named collection
+- Documents still being ingested get a "still processing" reply
 """
 
 from __future__ import annotations
 
 import logging
 import traceback
-from typing import Any, Iterable, Optional
+from typing import Any, Iterable, Iterator, List, Optional
 
-from RAG.rag_engine import answer as rag_answer
+from RAG.rag_engine import answer as rag_answer, answer_stream as rag_answer_stream
+from components.Filespage.service import get_file
 from services.mcp_service import handle_chat_stream, handle_home_message
 
 logger = logging.getLogger(__name__)
@@ -39,6 +43,67 @@ def _sse_line(data: str) -> str:
     return f"data: {data}\n"
 
 
+def _sse_stream(tokens: Iterable[str]) -> Iterator[str]:
+    """
+    Re-frame tokens as one SSE line per line of text, sent as soon as the
+    line is complete. Lines go out unchanged (indentation, code blocks,
+    empty lines between paragraphs); the client joins them with '\\n'.
+    """
+    buffer = ""
+
+    for token in tokens:
+        if token.strip() == "[DONE]":
+            continue
+
+        buffer += token
+
+        if "\n" in buffer:
+            # Complete lines go out now; keep the unfinished tail
+            *done, buffer = buffer.split("\n")
+            for line in done:
+                yield _sse_line(line)
+
+    if buffer:
+        yield _sse_line(buffer)
+
+
+def _normalize_file_ids(file_ids: Any) -> List[str]:
+    if isinstance(file_ids, str):
+        file_ids = [file_ids]
+    if not isinstance(file_ids, (list, tuple)):
+        return []
+    return [str(f).strip() for f in file_ids if f is not None and str(f).strip()]
+
+
+def _has_documents(
+    file_id: Optional[str],
+    file_ids: List[str],
+    collection: Optional[str],
+) -> bool:
+    return bool(file_id or file_ids or collection)
+
+
+def _processing_message(
+    file_id: Optional[str],
+    file_ids: List[str],
+    user_id: Optional[str],
+) -> Optional[str]:
+    """Reply for documents whose (background) ingestion has not finished."""
+    pending = []
+    for fid in dict.fromkeys(([file_id] if file_id else []) + file_ids):
+        record = get_file(fid, user_id=user_id)
+        if record and record.get("status") not in ("indexed", "failed"):
+            pending.append(f'"{record.get("name") or fid}"')
+
+    if not pending:
+        return None
+    noun, verb = ("Documents", "are") if len(pending) > 1 else ("Document", "is")
+    return (
+        f"{noun} {', '.join(pending)} {verb} still being processed. "
+        "Please ask again in a moment."
+    )
+
+
 def _is_document_question(message: str) -> bool:
     msg = message.lower()
     return any(
@@ -50,6 +115,7 @@ def _is_document_question(message: str) -> bool:
             "table", "figure", "paragraph",
             "section", "chapter",
             "this file", "this pdf",
+            "compare",
         )
     )
 
@@ -62,17 +128,32 @@ def chatpage_chat_handler(
     context: Any = None,
     mode: Optional[str] = None,
     file_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    file_ids: Any = None,
+    collection: Optional[str] = None,
 ) -> str:
     clean = _normalize_message(message)
     if not clean:
         return "Please enter a valid message."
 
+    file_ids = _normalize_file_ids(file_ids)
+
     try:
-        if not file_id:
+        if not _has_documents(file_id, file_ids, collection):
             return handle_home_message(clean)
 
         if _is_document_question(clean):
-            return rag_answer(clean, file_id=file_id)
+            processing = _processing_message(file_id, file_ids, user_id)
+            if processing:
+                return processing
+
+            return rag_answer(
+                clean,
+                file_id=file_id,
+                user_id=user_id,
+                file_ids=file_ids,
+                collection=collection,
+            )
 
         return handle_home_message(clean)
 
@@ -89,6 +170,9 @@ def chatpage_chat_stream_handler(
     context: Any = None,
     mode: Optional[str] = None,
     file_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    file_ids: Any = None,
+    collection: Optional[str] = None,
 ):
     clean = _normalize_message(message)
     if not clean:
@@ -96,63 +180,44 @@ def chatpage_chat_stream_handler(
         yield "data: [DONE]\n"
         return
 
-    def should_flush(buf: str) -> bool:
-        return buf.endswith((".", "?", "!", "\n"))
+    file_ids = _normalize_file_ids(file_ids)
 
     try:
         # ---------------- NO DOCUMENT ----------------
-        if not file_id:
-            buffer = ""
-
-            for token in handle_chat_stream(
-                clean,
-                context=context,
-                mode=mode,
-            ):
-                if token.strip() == "[DONE]":
-                    continue
-
-                buffer += token
-
-                if should_flush(buffer):
-                    yield f"data: {buffer.strip()}\n"
-                    buffer = ""
-
-            if buffer.strip():
-                yield f"data: {buffer.strip()}\n"
-
+        if not _has_documents(file_id, file_ids, collection):
+            yield from _sse_stream(
+                handle_chat_stream(clean, context=context, mode=mode)
+            )
             yield "data: [DONE]\n"
             return
 
         # ---------------- DOCUMENT (RAG) ----------------
         if _is_document_question(clean):
-            answer = rag_answer(clean, file_id=file_id)
-            yield f"data: {answer}\n"
+            processing = _processing_message(file_id, file_ids, user_id)
+            if processing:
+                yield from _sse_stream([processing])
+                yield "data: [DONE]\n"
+                return
+
+            yield from _sse_stream(
+                rag_answer_stream(
+                    clean,
+                    file_id=file_id,
+                    user_id=user_id,
+                    file_ids=file_ids,
+                    collection=collection,
+                )
+            )
             yield "data: [DONE]\n"
             return
 
         # ---------------- CASUAL CHAT WITH DOC ----------------
-        buffer = ""
-
-        for token in handle_chat_stream(
-            clean,
-            context=context,
-            mode=mode,
-        ):
-            if token.strip() == "[DONE]":
-                continue
-
-            buffer += token
-
-            if should_flush(buffer):
-                yield f"data: {buffer.strip()}\n"
-                buffer = ""
-
-        if buffer.strip():
-            yield f"data: {buffer.strip()}\n"
-
+        yield from _sse_stream(
+            handle_chat_stream(clean, context=context, mode=mode)
+        )
         yield "data: [DONE]\n"
 
     except Exception:
+        logger.exception("[CHATPAGE] Streaming error")
         yield "data: An internal server error occurred.\n"
         yield "data: [DONE]\n"